@@ -0,0 +1,274 @@
+# vi:si:et:sw=4:sts=4:ts=4
+# -*- coding: UTF-8 -*-
+# -*- Mode: Python -*-
+"""asyncio client for the snom redirection service (Python 3 only)
+
+The redirection operations are exposed as coroutines sharing a small pool of
+keep-alive HTTPS streams; a semaphore bounds the number of requests in flight.
+The XML-RPC payloads are built and parsed with the stdlib xmlrpc marshalling.
+Every request can be reported to a 'stats' object with the
+record(method, seconds, sent, received, error, rejected, sent_xml, received_xml)
+method of snomcli.RpcStats, and paced by a 'scheduler' with the interface of
+snomcli.Scheduler (rate limit, retries with backoff, adaptive concurrency).
+With a 'compress' threshold (in bytes), larger request bodies are sent gzip
+encoded and gzip encoded responses are accepted.
+"""
+
+import asyncio
+import gzip
+import ssl
+import time
+from base64 import b64encode
+from urllib.parse import urlsplit
+from xmlrpc.client import dumps, loads, Fault, ProtocolError
+
+
+# calls changing the state of the server: not resent after an ambiguous failure
+MUTATING_METHODS = ("redirect.registerPhone", "redirect.deregisterPhone")
+
+
+def gzip_refused(err):
+    """ True if 'err' is the answer of a server to a gzip encoded request it does not take:
+    an HTTP error or a fault of its XML parser (a server ignoring the Content-Encoding) """
+    if isinstance(err, ProtocolError):
+        return err.errcode in (400, 415, 501)
+    return err.faultCode == -32700 or "ExpatError" in str(err.faultString)
+
+
+class AsyncRedirectionClient(object):
+    """ Coroutine based redirection client """
+
+    def __init__(self, url, user, password, limit=8, ssl_context=None, stats=None, scheduler=None, compress=None):
+        parts = urlsplit(url)
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == "https" else 80)
+        self.handler = parts.path or "/"
+        if self.scheme == "https":
+            self.ssl_context = ssl_context or ssl._create_unverified_context()
+        else:
+            self.ssl_context = None
+        auth = b64encode(("%s:%s" % (user, password)).encode("utf-8")).decode("ascii")
+        # the request headers never change: build them once
+        self._headers = ("POST %s HTTP/1.1\r\n"
+                         "Host: %s:%d\r\n"
+                         "Content-Type: text/xml\r\n"
+                         "Authorization: Basic %s\r\n"
+                         "Connection: keep-alive\r\n" % (self.handler, self.host, self.port, auth)).encode("ascii")
+        if compress:
+            self._headers += b"Accept-Encoding: gzip\r\n"
+        self.compress = compress
+        self.limit = limit
+        self.stats = stats
+        self.scheduler = scheduler
+        # created on first use, inside the event loop running the client
+        self._semaphore = None
+        self._idle = []
+        self.requests = 0
+        self.connections = 0
+
+    async def _connect(self):
+        """ Return (reader, writer, reused) of an idle keep-alive connection or a new one """
+        while self._idle:
+            reader, writer = self._idle.pop()
+            # skip the connections the server closed while they were idle
+            if not reader.at_eof():
+                return reader, writer, True
+            writer.close()
+        self.connections += 1
+        try:
+            reader, writer = await asyncio.open_connection(self.host, self.port, ssl=self.ssl_context)
+        except OSError as err:
+            # nothing was sent: the request can be sent again whatever it does
+            err.before_request = True
+            raise
+        return reader, writer, False
+
+    async def _read_response(self, reader):
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("connection closed by the server")
+        version, status, reason = (status_line.decode("latin-1").rstrip("\r\n").split(" ", 2) + [""])[:3]
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, value = line.decode("latin-1").split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            body = b""
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    await reader.readline()
+                    break
+                body += await reader.readexactly(size)
+                await reader.readline()
+        elif "content-length" in headers:
+            body = await reader.readexactly(int(headers["content-length"]))
+        else:
+            body = await reader.read()
+            headers["connection"] = "close"
+        keep_alive = headers.get("connection", "").lower() != "close" and version != "HTTP/1.0"
+        return int(status), reason, headers, body, keep_alive
+
+    async def call(self, method, *params):
+        """ Run the XML-RPC 'method' and return its result """
+        xml = dumps(params, method, allow_none=True).encode("utf-8", "xmlcharrefreplace")
+        idempotent = method not in MUTATING_METHODS
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.limit)
+        async with self._semaphore:
+            started = time.time()
+            body = xml
+            counts = [0, 0]  # response bytes on the wire and decompressed
+            result = None
+            try:
+                if self.compress and len(xml) > self.compress:
+                    body = gzip.compress(xml, 1)
+                    try:
+                        result = await self._scheduled_call(body, True, counts, idempotent)
+                        return result
+                    except (ProtocolError, Fault) as err:
+                        if not gzip_refused(err):
+                            raise
+                        # the server does not take compressed requests
+                        self.compress = None
+                        body = xml
+                result = await self._scheduled_call(body, False, counts, idempotent)
+                return result
+            finally:
+                if self.stats is not None:
+                    self.stats.record(method, time.time() - started, len(body), counts[0], result is None,
+                                      isinstance(result, list) and result[:1] == [False], len(xml), counts[1])
+
+    async def _scheduled_call(self, body, compressed, counts, idempotent):
+        scheduler = self.scheduler
+        if scheduler is None:
+            return await self._call(body, compressed, counts, idempotent)
+        attempt = 0
+        while True:
+            delay = scheduler.reserve()
+            if delay:
+                await asyncio.sleep(delay)
+            while not scheduler.try_enter():
+                await asyncio.sleep(0.005)
+            started = time.time()
+            try:
+                result = await self._call(body, compressed, counts, idempotent)
+            except Exception as err:
+                delay = scheduler.fail(time.time() - started, err, attempt, idempotent)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            scheduler.leave(time.time() - started)
+            return result
+
+    async def _call(self, body, compressed, counts, idempotent):
+        request = (self._headers + (b"Content-Encoding: gzip\r\n" if compressed else b"") +
+                   ("Content-Length: %d\r\n\r\n" % len(body)).encode("ascii") + body)
+        for attempt in (0, 1):
+            reader, writer, reused = await self._connect()
+            try:
+                writer.write(request)
+                await writer.drain()
+                status, reason, headers, data, keep_alive = await self._read_response(reader)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                writer.close()
+                # a reused connection may have failed after the server processed the
+                # request: only resend what is idempotent
+                if attempt or not reused or not idempotent:
+                    raise
+                continue
+            break
+        self.requests += 1
+        counts[0] += len(data)
+        if headers.get("content-encoding", "").lower() == "gzip":
+            data = gzip.decompress(data)
+        counts[1] += len(data)
+        if keep_alive:
+            self._idle.append((reader, writer))
+        else:
+            writer.close()
+        if status != 200:
+            raise ProtocolError("%s:%d%s" % (self.host, self.port, self.handler), status, reason, headers)
+        return loads(data, use_builtin_types=True)[0][0]
+
+    # redirection operations
+
+    async def list_phones(self, model, url=None):
+        return await self.call("redirect.listPhones", model, url)
+
+    async def check_phone(self, mac):
+        return await self.call("redirect.checkPhone", mac)
+
+    async def get_phone_redirection(self, mac):
+        return await self.call("redirect.getPhoneRedirection", mac)
+
+    async def register_phone(self, mac, url):
+        return await self.call("redirect.registerPhone", mac, url)
+
+    async def deregister_phone(self, mac):
+        return await self.call("redirect.deregisterPhone", mac)
+
+    async def echo(self, text):
+        return await self.call("network.echo", text)
+
+    async def register_new_phone(self, mac, url):
+        """ checkPhone then registerPhone, refusing phones that are already registered """
+        result = await self.check_phone(mac)
+        if result[0]:
+            return (False, "Error:already_registered")
+        return await self.register_phone(mac, url)
+
+    async def update_phone(self, mac, url):
+        """ Re-register a phone to 'url', registering it if it is not registered yet """
+        await self.deregister_phone(mac)
+        return await self.register_phone(mac, url)
+
+    async def ensure_phone(self, mac, url):
+        """ register_new_phone() for a phone that may already have been registered to 'url' by an
+        interrupted run: that registration counts as a success """
+        result = await self.get_phone_redirection(mac)
+        if result[0] and result[2] == url:
+            return [True]
+        return await self.register_new_phone(mac, url)
+
+    def close(self):
+        for reader, writer in self._idle:
+            writer.close()
+        self._idle = []
+
+
+def run_bulk(client, calls, callback, limit=8):
+    """ Run every (item, method, args) of the iterable 'calls' on 'client', at most 'limit'
+    at a time, and report each outcome as callback(item, result, exception).
+    'calls' is consumed lazily, so arbitrarily large inputs are streamed. """
+
+    async def run_one(item, method, args):
+        try:
+            result = await getattr(client, method)(*args)
+        except Exception as err:
+            callback(item, None, err)
+        else:
+            callback(item, result, None)
+
+    async def main():
+        pending = set()
+        for item, method, args in calls:
+            if len(pending) >= limit * 2:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            pending.add(asyncio.ensure_future(run_one(item, method, args)))
+        if pending:
+            await asyncio.wait(pending)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(main())
+    finally:
+        client.close()
+        loop.close()
@@ -0,0 +1,92 @@
+#!/usr/bin/python
+# vi:si:et:sw=4:sts=4:ts=4
+# -*- coding: UTF-8 -*-
+"""Differential check and micro-benchmark of the compiled MAC classifier.
+
+Every MAC of the 000413 and 00087B spaces is classified both with the
+compiled range table (snomcli.classify_many) and with the original ordered
+regex scan over snomcli.macRegexList; any disagreement is reported and makes
+the script exit with a non-zero status.
+
+    python benchmarks/bench_classify.py [--step N] [--jobs N]
+"""
+
+import multiprocessing
+import optparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import snomcli
+
+OUIS = ("000413", "00087B")
+CHUNK = 1 << 16
+
+
+def regex_type(mac):
+    if not snomcli.macPattern.match(mac):
+        return None
+    for regex, phone in snomcli.macRegexList:
+        if regex.match(mac):
+            return phone
+    return None
+
+
+def check_chunk(args):
+    oui, start, step = args
+    macs = ["%s%06X" % (oui, n) for n in range(start, start + CHUNK, step)]
+    mismatches = []
+    for mac, phone in zip(macs, snomcli.classify_many(macs)):
+        expected = regex_type(mac)
+        if phone != expected:
+            mismatches.append((mac, expected, phone))
+    return len(macs), mismatches
+
+
+def bench(label, func, macs):
+    started = time.time()
+    func(macs)
+    elapsed = time.time() - started
+    print("%-28s %10d MACs %8.3fs %12.0f MACs/s" % (label, len(macs), elapsed, len(macs) / elapsed))
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("--step", type="int", default=1, help="check every Nth MAC (default: all)")
+    parser.add_option("--jobs", type="int", default=multiprocessing.cpu_count(), help="worker processes")
+    parser.add_option("--bench-size", type="int", default=200000, help="MACs per benchmark run")
+    options, _ = parser.parse_args()
+
+    started = time.time()
+    tasks = [(oui, start, options.step) for oui in OUIS for start in range(0, 1 << 24, CHUNK)]
+    pool = multiprocessing.Pool(options.jobs)
+    checked = 0
+    mismatches = []
+    for count, bad in pool.imap_unordered(check_chunk, tasks):
+        checked += count
+        mismatches.extend(bad)
+    pool.close()
+    pool.join()
+    print("differential check: %d MACs in %.1fs, %d mismatches" % (checked, time.time() - started, len(mismatches)))
+    for mac, expected, phone in sorted(mismatches)[:20]:
+        print("  %s: regex=%s table=%s" % (mac, expected, phone))
+
+    stride = max(1, (2 << 24) // options.bench_size)
+    macs = ["%s%06X" % (OUIS[n & 1], (n * stride) & 0xFFFFFF) for n in range(options.bench_size)]
+    snomcli.load_mac_table()
+    bench("regex scan", lambda m: [regex_type(x) for x in m], macs)
+    bench("classify_mac", lambda m: [snomcli.classify_mac(x) for x in m], macs)
+    bench("classify_many", snomcli.classify_many, macs)
+
+    started = time.time()
+    for _ in range(10):
+        snomcli._compile_mac_table(snomcli.macRegexList)
+    print("%-28s %.2fms (%d ranges)" % ("table compile", (time.time() - started) * 100, len(snomcli.macTableStarts)))
+
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
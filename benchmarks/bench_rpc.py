@@ -0,0 +1,150 @@
+#!/usr/bin/python
+# vi:si:et:sw=4:sts=4:ts=4
+# -*- coding: UTF-8 -*-
+"""Performance benchmarks of cli.py against the local stand-in server.
+
+For every account size a fresh benchmarks/fakeserver.py process is started
+and the console is timed on: process startup, 'list all', 'list <model>',
+a bulk 'import' of new phones and a bulk checkPhone of those phones, with
+the bytes each benchmark sent and received on the wire and as XML. The
+results are written as JSON so they can be compared across releases:
+
+    python benchmarks/bench_rpc.py --sizes 1000,10000 --latency 0.005 -o results.json
+
+'--compress 0' measures the uncompressed transport.
+"""
+
+import json
+import optparse
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+import snomcli
+from fakeserver import phone_macs
+
+USER = "bench"
+PASSWORD = "bench"
+
+
+def start_server(phones, options):
+    process = subprocess.Popen([sys.executable, os.path.join(HERE, "fakeserver.py"),
+                                "--phones", str(phones), "--user", USER, "--password", PASSWORD,
+                                "--latency", str(options.latency), "--jitter", str(options.jitter)],
+                               stdout=subprocess.PIPE, universal_newlines=True)
+    return process, process.stdout.readline().strip()
+
+
+def quiet(func, *args):
+    """ Run func(*args) with the console output discarded, return the elapsed seconds """
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    started = time.time()
+    try:
+        func(*args)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    return time.time() - started
+
+
+def bench_startup(url, home, runs):
+    env = dict(os.environ, HOME=home, SNOM_URL=url)
+    timings = []
+    for _ in range(runs):
+        started = time.time()
+        subprocess.check_call([sys.executable, os.path.join(HERE, "..", "cli.py"), "version"],
+                              env=env, stdout=open(os.devnull, "w"))
+        timings.append(time.time() - started)
+    return sorted(timings)[len(timings) // 2]
+
+
+def run_size(size, options):
+    process, url = start_server(size, options)
+    home = tempfile.mkdtemp()
+    results = []
+
+    def record(name, seconds, count):
+        methods = list(snomcli.rpc_stats.methods.values())
+        sent = sum(s.sent for s in methods)
+        received = sum(s.received for s in methods)
+        results.append({"benchmark": name, "phones": size, "seconds": round(seconds, 4),
+                        "per_second": round(count / seconds, 1) if seconds else None,
+                        "bytes_sent": sent, "bytes_received": received,
+                        "xml_bytes_sent": sum(s.sent_xml for s in methods),
+                        "xml_bytes_received": sum(s.received_xml for s in methods)})
+        sys.stderr.write("%-12s %8d phones %9.3fs %12d bytes sent %12d received\n" % (name, size, seconds,
+                                                                                    sent, received))
+        snomcli.rpc_stats.reset()
+
+    try:
+        with open(os.path.join(home, ".snomcli"), "w") as config:
+            config.write("username|%s\npassword|%s\nworkers|%d\ncompress|%d" % (USER, PASSWORD, options.workers,
+                                                                                 options.compress))
+        os.environ["HOME"] = home
+        snomcli.rpc_url = url
+        snomcli.server = None
+        snomcli.inventory = None
+        snomcli.load_defaults()
+        snomcli.username, snomcli.banner = USER, ""
+        console = snomcli.RedirectionCli()
+
+        record("startup", bench_startup(url, home, options.startup_runs), 1)
+        record("list_all", quiet(console.onecmd, "list all --fresh"), size)
+        record("list_model", quiet(console.onecmd, "list %s --fresh" % snomcli.models[0]), size // len(snomcli.models))
+
+        csvfile = os.path.join(home, "import.csv")
+        new_macs = list(phone_macs(size, size))
+        with open(csvfile, "w") as f:
+            f.write("\n".join("%s,http://bench.example.com/" % mac for mac in new_macs))
+        record("bulk_add", quiet(console.onecmd, "import %s" % csvfile), size)
+        record("bulk_check", quiet(snomcli.multicall, "redirect.checkPhone", [(mac,) for mac in new_macs]), size)
+    finally:
+        process.terminate()
+        process.wait()
+        shutil.rmtree(home)
+    return results
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("--sizes", default="1000,10000,100000", help="comma separated account sizes")
+    parser.add_option("--latency", type="float", default=0.001, help="server latency per request (seconds)")
+    parser.add_option("--jitter", type="float", default=0.0, help="server jitter per request (seconds)")
+    parser.add_option("--workers", type="int", default=8, help="'defaults workers' of the console")
+    parser.add_option("--compress", type="int", default=snomcli.defaults["compress"],
+                      help="'defaults compress' of the console (bytes, 0 for no compression)")
+    parser.add_option("--startup-runs", type="int", default=5)
+    parser.add_option("-o", "--output", help="write the JSON results to this file instead of stdout")
+    options, _ = parser.parse_args()
+
+    report = {
+        "version": snomcli.__version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "latency": options.latency,
+        "jitter": options.jitter,
+        "workers": options.workers,
+        "compress": options.compress,
+        "results": [],
+    }
+    for size in [int(s) for s in options.sizes.split(",")]:
+        report["results"].extend(run_size(size, options))
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if options.output:
+        with open(options.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+#!/usr/bin/python
+# vi:si:et:sw=4:sts=4:ts=4
+# -*- coding: UTF-8 -*-
+"""Startup cost of cli.py, phase by phase.
+
+Every phase is measured in fresh interpreters (median of --runs) so module
+and bytecode caches behave as in real one-shot invocations:
+
+    interpreter    python -c pass
+    compile        compiling the cli.py script (paid by every 'python cli.py ...';
+                   the snomcli module behind it is loaded from cached bytecode)
+    imports        the standard library modules snomcli.py depends on
+    module         executing the snomcli module body
+    mac_table      compiling the MAC range table, done by the commands classifying many MACs
+    defaults       load_defaults() reading ~/.snomcli
+    readline       setup_readline(), interactive sessions only
+    console        building the RedirectionCli command processor
+    credentials    reading the cached credentials
+    echo           the network.echo round trip verifying a typed password
+    first_rpc      opening the connection and running a first checkPhone
+
+followed by end-to-end invocations of 'version', 'type' and 'check' against
+a local benchmarks/fakeserver.py:
+
+    python benchmarks/bench_startup.py --runs 20 --latency 0.02 -o startup.json
+
+With --baseline, the one-shot commands are compared with the results of an
+earlier run (Eg. of the release before) and the script exits with a non-zero
+status if one of them got slower by more than --tolerance:
+
+    python benchmarks/bench_startup.py --baseline startup-1.4.2.json
+"""
+
+import json
+import optparse
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, "..")
+CLI = os.path.join(ROOT, "cli.py")
+
+USER = "bench"
+PASSWORD = "bench"
+
+# run in a fresh interpreter: prints the JSON {phase: seconds} of one startup
+PROBE = r"""
+import json, sys, time
+timings = {}
+started = time.time()
+import cmd, getpass, binascii, os, re, ssl, bisect, heapq, itertools, json, zlib, socket, csv, threading
+try:
+    import xmlrpc.client, http.client, queue
+except ImportError:
+    import xmlrpclib, httplib, Queue
+timings["imports"] = time.time() - started
+
+with open(sys.argv[1]) as source:
+    code = source.read()
+started = time.time()
+compile(code, sys.argv[1], "exec")
+timings["compile"] = time.time() - started
+
+sys.path.insert(0, sys.argv[2])
+started = time.time()
+import snomcli
+timings["module"] = time.time() - started
+
+started = time.time()
+snomcli._compile_mac_table(snomcli.macRegexList)
+timings["mac_table"] = time.time() - started
+
+started = time.time()
+snomcli.load_defaults()
+timings["defaults"] = time.time() - started
+
+started = time.time()
+snomcli.setup_readline()
+timings["readline"] = time.time() - started
+
+started = time.time()
+snomcli.RedirectionCli()
+timings["console"] = time.time() - started
+
+started = time.time()
+snomcli.load_credentials(snomcli.defaults["username"])
+timings["credentials"] = time.time() - started
+
+started = time.time()
+snomcli.validate_password(snomcli.defaults["username"], sys.argv[3])
+timings["echo"] = time.time() - started
+
+snomcli.get_pool(snomcli.split_rpc_url(snomcli.rpc_url)[0], snomcli.defaults["username"]).close()
+started = time.time()
+snomcli.get_server().redirect.checkPhone(sys.argv[4])
+timings["first_rpc"] = time.time() - started
+
+print(json.dumps(timings))
+"""
+
+
+def start_server(options):
+    process = subprocess.Popen([sys.executable, os.path.join(HERE, "fakeserver.py"),
+                                "--phones", "10", "--user", USER, "--password", PASSWORD,
+                                "--latency", str(options.latency)],
+                               stdout=subprocess.PIPE, universal_newlines=True)
+    return process, process.stdout.readline().strip()
+
+
+def median(values):
+    return sorted(values)[len(values) // 2]
+
+
+def wall_time(args, env):
+    with open(os.devnull, "w") as devnull:
+        started = time.time()
+        subprocess.check_call(args, env=env, stdout=devnull)
+        return time.time() - started
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("--runs", type="int", default=10, help="fresh interpreters per measurement")
+    parser.add_option("--latency", type="float", default=0.0, help="server latency per request (seconds)")
+    parser.add_option("-o", "--output", help="write the JSON results to this file instead of stdout")
+    parser.add_option("--baseline", help="JSON results of an earlier run the one-shot commands must not be slower than")
+    parser.add_option("--tolerance", type="float", default=0.1,
+                      help="slowdown allowed over the baseline, as a fraction (default 0.1)")
+    options, _ = parser.parse_args()
+    baseline = None
+    if options.baseline:
+        with open(options.baseline) as f:
+            baseline = dict((result["phase"], result["seconds"]) for result in json.load(f)["results"])
+
+    sys.path.insert(0, ROOT)
+    from fakeserver import phone_macs
+    mac = next(phone_macs(0, 1))
+
+    process, url = start_server(options)
+    home = tempfile.mkdtemp()
+    results = []
+
+    def record(name, seconds):
+        results.append({"phase": name, "seconds": round(seconds, 5)})
+        sys.stderr.write("%-16s %8.1f ms\n" % (name, seconds * 1000))
+
+    try:
+        env = dict(os.environ, HOME=home, SNOM_URL=url)
+        config = os.path.join(home, ".snomcli")
+        with open(config, "w") as f:
+            f.write("username|%s\npassword|%s" % (USER, PASSWORD))
+
+        record("interpreter", median([wall_time([sys.executable, "-c", "pass"], env) for _ in range(options.runs)]))
+        phases = []
+        for _ in range(options.runs):
+            output = subprocess.check_output([sys.executable, "-c", PROBE, CLI, ROOT, PASSWORD, mac],
+                                             env=env, universal_newlines=True)
+            phases.append(json.loads(output.splitlines()[-1]))
+        for name in ("compile", "imports", "module", "mac_table", "defaults", "readline", "console",
+                     "credentials", "echo", "first_rpc"):
+            record(name, median([timings[name] for timings in phases]))
+
+        for name, args in (("cmd_version", ["version"]), ("cmd_type", ["type", mac]), ("cmd_check", ["check", mac])):
+            record(name, median([wall_time([sys.executable, CLI] + args, env) for _ in range(options.runs)]))
+
+        # no saved password: it comes from the (opt-in) credential cache instead of a prompt and echo
+        with open(config, "w") as f:
+            f.write("username|%s\ncredttl|3600" % USER)
+        with open(os.path.join(home, ".snomcli_session"), "w") as f:
+            json.dump({"username": USER, "password": PASSWORD, "expires": time.time() + 3600}, f)
+        record("cmd_check_cached", median([wall_time([sys.executable, CLI, "check", mac], env)
+                                           for _ in range(options.runs)]))
+    finally:
+        process.terminate()
+        process.wait()
+        shutil.rmtree(home)
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "latency": options.latency,
+        "runs": options.runs,
+        "results": results,
+    }
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if options.output:
+        with open(options.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if baseline is not None:
+        slower = []
+        for result in results:
+            name = result["phase"]
+            if not name.startswith("cmd_") or name not in baseline:
+                continue
+            limit = baseline[name] * (1 + options.tolerance)
+            sys.stderr.write("%-16s %8.1f ms, baseline %8.1f ms%s\n" % (
+                name, result["seconds"] * 1000, baseline[name] * 1000, "  SLOWER" if result["seconds"] > limit else ""))
+            if result["seconds"] > limit:
+                slower.append(name)
+        if slower:
+            sys.exit("slower than the baseline: %s" % ", ".join(slower))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+#!/usr/bin/python
+# vi:si:et:sw=4:sts=4:ts=4
+# -*- coding: UTF-8 -*-
+"""Local stand-in for the snom redirection XML-RPC service.
+
+Implements the redirect.* and network.echo calls used by cli.py (plus
+system.multicall) over HTTPS with Basic auth and in-memory state, with
+configurable latency, jitter and error injection:
+
+    python benchmarks/fakeserver.py --phones 10000 --latency 0.02 --jitter 0.01
+
+The first line printed is the URL to export as SNOM_URL; the console then
+talks to the stand-in instead of secure-provisioning.snom.com.
+"""
+
+import base64
+import optparse
+import os
+import random
+import shutil
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    from xmlrpc.server import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+    from socketserver import ThreadingMixIn
+except ImportError:  # Python 2 fallback
+    from SimpleXMLRPCServer import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+    from SocketServer import ThreadingMixIn
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import snomcli
+
+OTHER_USER = "someone-else"
+
+
+def phone_macs(first, count):
+    """ Yield 'count' distinct valid MACs spread over the phone models, starting at the
+    'first'-th one: phone_macs(0, n) are the phones seeded by the server """
+    snomcli.load_mac_table()
+    segments = [(start, model) for start, end, model in
+                zip(snomcli.macTableStarts, snomcli.macTableStarts[1:] + [1 << 48], snomcli.macTableModels)
+                if model and end - start >= 1 << 16]
+    for n in range(first, first + count):
+        start, model = segments[n % len(segments)]
+        yield "%012X" % (start + n // len(segments))
+
+
+class RedirectionState(object):
+    """ In-memory phone registry: mac -> [owner, company, url] """
+
+    def __init__(self):
+        self.phones = {}
+        self.by_model = {}
+        self.lock = threading.Lock()
+
+    def seed(self, count, user, company="ACME", url="http://provisioning.example.com/", other=0):
+        """ Register 'count' phones for 'user' (and 'other' for another user), spread over the models """
+        for n, mac in enumerate(phone_macs(0, count + other)):
+            self.register(mac, user if n < count else OTHER_USER, company, url)
+
+    def register(self, mac, owner, company, url):
+        with self.lock:
+            self.phones[mac] = [owner, company, url]
+            self.by_model.setdefault(snomcli.classify_mac(mac), set()).add(mac)
+
+    def deregister(self, mac):
+        with self.lock:
+            del self.phones[mac]
+            self.by_model[snomcli.classify_mac(mac)].discard(mac)
+
+
+class RedirectionService(object):
+    """ The redirect.* calls, answered for the user of the current request """
+
+    def __init__(self, state, company="ACME"):
+        self.state = state
+        self.company = company
+        self.local = threading.local()
+
+    def _owned(self, mac):
+        if not isinstance(mac, str) or not snomcli.classify_mac(mac):
+            return [False, "Error:malformed_mac"]
+        entry = self.state.phones.get(mac.upper())
+        if entry is None:
+            return [False, "Error:no_such_mac"]
+        if entry[0] != self.local.user:
+            return [False, "Error:owned_by_other_user"]
+        return None
+
+    def listPhones(self, model, url=None):
+        if model not in snomcli.models:
+            return [False, "Error:unknown_model"]
+        phones = self.state.phones
+        user = self.local.user
+        return sorted(mac for mac in list(self.state.by_model.get(model, ()))
+                      if phones[mac][0] == user and (url is None or phones[mac][2] == url))
+
+    def checkPhone(self, mac):
+        return self._owned(mac) or [True]
+
+    def getPhoneRedirection(self, mac):
+        error = self._owned(mac)
+        if error:
+            return error
+        entry = self.state.phones[mac.upper()]
+        return [True, entry[1], entry[2]]
+
+    def registerPhone(self, mac, url):
+        error = self._owned(mac)
+        if error and error[1] != "Error:no_such_mac":
+            return error
+        self.state.register(mac.upper(), self.local.user, self.company, url)
+        return [True]
+
+    def deregisterPhone(self, mac):
+        error = self._owned(mac)
+        if error:
+            return error
+        self.state.deregister(mac.upper())
+        return [True]
+
+
+class FakeServer(ThreadingMixIn, SimpleXMLRPCServer):
+    daemon_threads = True
+
+
+class FakeRequestHandler(SimpleXMLRPCRequestHandler):
+    protocol_version = "HTTP/1.1"
+    rpc_paths = ()
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            SimpleXMLRPCRequestHandler.log_message(self, format, *args)
+
+    def do_POST(self):
+        server = self.server
+        expected = "Basic " + base64.b64encode(("%s:%s" % (server.user, server.password)).encode("utf-8")).decode("ascii")
+        if self.headers.get("Authorization") != expected:
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            return self.reject(401, "Unauthorized")
+        server.attempts += 1
+        try:
+            status = server.failures.pop(0)
+        except IndexError:
+            status = None
+        if status:
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            return self.reject(status, "Injected failure")
+        delay = server.latency + random.uniform(0, server.jitter)
+        if delay:
+            time.sleep(delay)
+        if server.error_rate and random.random() < server.error_rate:
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            return self.reject(503, "Service Unavailable")
+        server.requests += 1
+        server.service.local.user = server.user
+        SimpleXMLRPCRequestHandler.do_POST(self)
+
+    def reject(self, code, message):
+        self.send_response(code, message)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+def make_certificate(directory):
+    """ Create a throw-away self-signed certificate with the openssl tool """
+    cert = os.path.join(directory, "cert.pem")
+    key = os.path.join(directory, "key.pem")
+    with open(os.devnull, "w") as devnull:
+        subprocess.check_call(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+                               "-subj", "/CN=localhost", "-keyout", key, "-out", cert],
+                              stdout=devnull, stderr=devnull)
+    return cert, key
+
+
+def start(phones=0, user="bench", password="bench", host="127.0.0.1", port=0, latency=0.0, jitter=0.0,
+          error_rate=0.0, fault_rate=0.0, certfile=None, keyfile=None, verbose=False):
+    """ Start a stand-in server in a background thread and return it; its URL is in server.url """
+    state = RedirectionState()
+    state.seed(phones, user)
+    service = RedirectionService(state)
+    server = FakeServer((host, port), requestHandler=FakeRequestHandler, logRequests=verbose, allow_none=True)
+    server.user, server.password = user, password
+    server.latency, server.jitter, server.error_rate = latency, jitter, error_rate
+    server.verbose = verbose
+    server.requests = 0
+    # tests: HTTP statuses answering the next requests, and the count of requests received
+    server.failures = []
+    server.attempts = 0
+    server.state, server.service = state, service
+
+    def fault(func):
+        def call(*args):
+            if fault_rate and random.random() < fault_rate:
+                raise Exception("injected fault")
+            return func(*args)
+        return call
+
+    for name in ("listPhones", "checkPhone", "getPhoneRedirection", "registerPhone", "deregisterPhone"):
+        server.register_function(fault(getattr(service, name)), "redirect." + name)
+    server.register_function(lambda text: text, "network.echo")
+    server.register_multicall_functions()
+
+    tmpdir = None
+    if certfile is None:
+        tmpdir = tempfile.mkdtemp()
+        certfile, keyfile = make_certificate(tmpdir)
+    context = ssl.SSLContext(getattr(ssl, "PROTOCOL_TLS_SERVER", ssl.PROTOCOL_SSLv23))
+    context.load_cert_chain(certfile, keyfile)
+    # handshake in the request threads rather than serially in the accept loop
+    server.socket = context.wrap_socket(server.socket, server_side=True, do_handshake_on_connect=False)
+    if tmpdir:
+        shutil.rmtree(tmpdir)
+
+    server.url = "https://localhost:%d/xmlrpc/" % server.server_address[1]
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("--host", default="127.0.0.1")
+    parser.add_option("--port", type="int", default=0, help="listening port (default: any free port)")
+    parser.add_option("--user", default="bench")
+    parser.add_option("--password", default="bench")
+    parser.add_option("--phones", type="int", default=1000, help="phones registered for the user at start")
+    parser.add_option("--latency", type="float", default=0.0, help="seconds added to every request")
+    parser.add_option("--jitter", type="float", default=0.0, help="random extra seconds added to every request")
+    parser.add_option("--error-rate", type="float", default=0.0, help="share of requests answered with HTTP 503")
+    parser.add_option("--fault-rate", type="float", default=0.0, help="share of calls answered with an XML-RPC fault")
+    parser.add_option("--cert", help="PEM certificate (default: a generated self-signed one)")
+    parser.add_option("--key", help="PEM private key of --cert")
+    parser.add_option("--verbose", action="store_true", default=False, help="log every request")
+    options, _ = parser.parse_args()
+
+    server = start(options.phones, options.user, options.password, options.host, options.port,
+                   options.latency, options.jitter, options.error_rate, options.fault_rate,
+                   options.cert, options.key, options.verbose)
+    print(server.url)
+    sys.stdout.flush()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
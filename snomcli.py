@@ -0,0 +1,4166 @@
+# vi:si:et:sw=4:sts=4:ts=4
+# -*- coding: UTF-8 -*-
+# -*- Mode: Python -*-
+
+import cmd
+import errno
+import getpass
+import binascii
+
+try:
+    from xmlrpc.client import SafeTransport, ServerProxy, MultiCall, Error, ProtocolError, Fault
+    from xmlrpc.client import Unmarshaller, ExpatParser, dumps
+    import http.client as HttpClient
+    from urllib.parse import urlsplit
+except ImportError:  # Python 2 fallback
+    from xmlrpclib import SafeTransport, ServerProxy, MultiCall, Error, ProtocolError, Fault
+    from xmlrpclib import Unmarshaller, ExpatParser, dumps
+    import httplib as HttpClient
+    from urlparse import urlsplit
+
+import os.path
+import sys
+import re
+import ssl
+import bisect
+import heapq
+import itertools
+import json
+import array
+import mmap
+import struct
+import zlib
+import socket
+import csv
+import threading
+import time
+import random
+import select
+try:
+    import queue as Queue
+except ImportError:  # Python 2 fallback
+    import Queue
+try:
+    import re._parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+from base64 import b64encode
+
+__version__ = "1.4.3"
+
+# check raw_input (python2.6)
+try:
+    input = raw_input
+except NameError:
+    pass
+
+
+error_map = {
+    "Error:malformed_mac": "Invalid MAC address",
+    "Error:no_such_mac": "MAC address not registered.",
+    "Error:owned_by_other_user": "MAC address is owned by another user."
+}
+
+# codes produced by this client, never sent by the server
+client_error_map = {
+    "Error:already_registered": "MAC address already registered.",
+    "Error:no_url": "No redirection url given and no default url defined.",
+    "Error:unknown_model": "Unknown device type (maybe not a snom MAC?)",
+    "Error:duplicate_mac": "Duplicate MAC address",
+    "Error:request_failed": "The request failed, try again."
+}
+
+
+def error_message(code):
+    """ Return the text for an error code of the server or the client, the code itself if unknown """
+    if code in client_error_map:
+        return client_error_map[code]
+    return error_map.get(code, code)
+
+defaults = {
+    "username": "",
+    "password": "",
+    "url": "",
+    "savelocals": 0,
+    "workers": 8,
+    "batchsize": 100,
+    "cachettl": 300,
+    "backend": "threads",
+    "credttl": 0,
+    "ratelimit": 0,
+    "retries": 3,
+    "compress": 1024,
+}
+
+macPattern = re.compile("^(000413[0-9A-F]{6})|(00087[bB][0-9A-F]{6})$")
+
+macRegexList = [
+        (re.compile('000413(25|28|2D|2F|34|36|37|3B|3D|3E|49|4A|4C|50|4E)[0-9A-F]{4}'), 'snom300'),
+        (re.compile('000413(24|27|2C|31|35|38|3F|4D|51)[0-9A-F]{4}'), 'snom320'),
+        (re.compile('000413(26|2E|3A|3C|52)[0-9A-F]{4}'), 'snom370'),
+        (re.compile('000413(30|56)[0-9A-F]{4}'), 'snomm9'),
+        (re.compile('000413(32|55)[0-9A-F]{4}'), 'snomMP'),
+        (re.compile('000413(61|63)[0-9A-F]{4}|00087B(08|09|0B)[0-9A-F]{4}'), 'snomM700'),
+        (re.compile('000413(62|B8)[0-9A-F]{4}|00087BD7[0-9A-F]{4}'), 'snomM300'),
+        (re.compile('000413B6[0-9A-F]{4}'), 'snomM900'),
+        (re.compile('000413(33|8D)[0-9A-F]{4}'), 'snomPA1'),
+        (re.compile('00041340[0-9A-F]{4}'), 'snom820'),
+        (re.compile('000413(45|46|48|4B|53)[0-9A-F]{4}'), 'snom821'),
+        (re.compile('000413(41|47|54)[0-9A-F]{4}'), 'snom870'),
+        (re.compile('000413(70|77|7D)[0-9A-F]{4}'), 'snom720'),
+        (re.compile('000413(78|86|8B|B7)[0-9A-F]{4}'), 'snom725'),
+        (re.compile('000413(71|7B)[0-9A-F]{4}'), 'snom760'),
+        (re.compile('00041394B4[0-1]{1}[0-9A-F]{1}|00041394B420'), 'snomD765'), # this must preceed the next rule: from 00041394B400 to 00041394B420 are D765
+        (re.compile('00041394B[4-9A-E]{1}[0-9A-F]{1}|00041394BF0[0-3]'), 'snom715'), # 00041394B421 to 00041394BF03 are 715
+        (re.compile('000413790[0-9A-F]{3}|000413(90|94)[0-9A-F]{4}'), 'snomD765'), # In the 00041379xxxx range only 000413790000 to 000413790FFF is used for snomD765
+        (re.compile('000413(79|8C)[0-9A-F]{4}'), 'snomD745'), # This test must follow the test for snomD765, as 000413790xxx is D765, 000413791000 to 00041379FFFF is snomD745
+        (re.compile('000413(74|76|7A|7C|7E|89)[0-9A-F]{4}'), 'snom710'),
+        (re.compile('000413(75|7F|87|8A|A5|B2)[0-9A-F]{4}'), 'snom715'),
+        (re.compile('000413(88|A8)[0-9A-F]{4}'), 'snomD712'),
+        (re.compile('000413(91|95)[0-9A-F]{4}'), 'snomD375'),
+        (re.compile('000413(83|8E)[0-9A-F]{4}'), 'snomD305'),
+        (re.compile('00041384001[A-F6-9]|0004138400[2-6][0-9A-F]|0004138400[2-7][0-9]'), 'snomD305'), #the MACs of the range '000413840016' to '000413840079' are D305 devices, rest is D315
+        (re.compile('00041384[0-9A-F]{4}|0004138F[0-9A-F]{4}'), 'snomD315'), # this must follow the D305 regex
+        (re.compile('00041385[0-9A-F]{4}|000413A1[0-9A-F]{4}'), 'snomD345'),
+        (re.compile('000413A6[0-9A-F]{4}'), 'snomD717'),
+        (re.compile('00041382[0-9A-F]{4}'), 'snomD120'),
+        (re.compile('000413A3[0-9A-F]{4}'), 'snomD735'),
+        (re.compile('000413A4[0-9A-F]{4}'), 'snomD335'),
+        (re.compile('00041364[0-9A-F]{4}'), 'snomM200SC'),
+        (re.compile('000413(92|96)[0-9A-F]{4}'), 'snomD785'),
+        (re.compile('00041393[0-9A-F]{4}'), 'snomD385'),
+        (re.compile('00041398[0-9A-F]{4}'), 'snomD765')
+]
+
+# phone models in the order of their first rule, so listings are merged deterministically
+models = [x[1] for i, x in enumerate(macRegexList) if x[1] not in [y[1] for y in macRegexList[:i]]]
+
+
+# MAC classifier table
+#
+# macRegexList is compiled once at import time into a sorted table of
+# disjoint integer MAC ranges, so a lookup is a single binary search instead
+# of up to ~35 regex matches. The rule order of macRegexList is preserved:
+# where two rules overlap the earlier one wins, exactly as in the regex scan.
+
+HEX_DIGITS = "0123456789ABCDEF"
+
+
+def _expand_regex(items):
+    """ Expand a parsed regex into a list of alternatives, each one being a
+    list of per-position character sets. """
+    alternatives = [[]]
+    for op, av in items:
+        if op == sre_parse.LITERAL:
+            choices = [[frozenset([chr(av)])]]
+        elif op == sre_parse.IN:
+            chars = set()
+            for in_op, in_av in av:
+                if in_op == sre_parse.LITERAL:
+                    chars.add(chr(in_av))
+                elif in_op == sre_parse.RANGE:
+                    chars.update(chr(c) for c in range(in_av[0], in_av[1] + 1))
+                else:
+                    raise ValueError("unsupported character class %s" % in_op)
+            choices = [[frozenset(chars)]]
+        elif op == sre_parse.SUBPATTERN:
+            choices = _expand_regex(av[-1])
+        elif op == sre_parse.BRANCH:
+            choices = []
+            for branch in av[1]:
+                choices.extend(_expand_regex(branch))
+        elif op == sre_parse.MAX_REPEAT and av[0] == av[1]:
+            choices = [[]]
+            sub = _expand_regex(av[2])
+            for _ in range(av[0]):
+                choices = [c + s for c in choices for s in sub]
+        elif op == sre_parse.AT:
+            continue
+        else:
+            raise ValueError("unsupported regex construct %s" % op)
+        alternatives = [a + c for a in alternatives for c in choices]
+    return alternatives
+
+
+def _regex_ranges(regex):
+    """ Return the integer MAC ranges (lo, hi) matched by 'regex' """
+    ranges = []
+    full = frozenset(HEX_DIGITS)
+    for alternative in _expand_regex(sre_parse.parse(regex.pattern)):
+        if len(alternative) > 12:
+            continue
+        # re.match() only anchors the start: shorter patterns match any tail
+        positions = [p & full for p in alternative] + [full] * (12 - len(alternative))
+        tail = 0
+        while tail < 12 and positions[11 - tail] == full:
+            tail += 1
+        prefixes = [0]
+        for chars in positions[:12 - tail]:
+            prefixes = [(p << 4) | int(c, 16) for p in prefixes for c in sorted(chars)]
+        for p in prefixes:
+            ranges.append((p << (4 * tail), ((p + 1) << (4 * tail)) - 1))
+    return ranges
+
+
+def _compile_mac_table(rules):
+    """ Compile an ordered list of (regex, model) rules into two parallel
+    lists: the sorted start of each MAC range and the model it maps to
+    (None for unknown MACs). """
+    events = {}
+    for index, (regex, phone) in enumerate(rules):
+        for lo, hi in _regex_ranges(regex):
+            events.setdefault(lo, []).append((index, 1))
+            events.setdefault(hi + 1, []).append((index, -1))
+    starts = [0]
+    phones = [None]
+    active = {}
+    heap = []
+    for point in sorted(events):
+        for index, delta in events[point]:
+            active[index] = active.get(index, 0) + delta
+            if delta > 0:
+                heapq.heappush(heap, index)
+        while heap and not active.get(heap[0]):
+            heapq.heappop(heap)
+        phone = rules[heap[0]][1] if heap else None
+        if phone != phones[-1]:
+            starts.append(point)
+            phones.append(phone)
+    return starts, phones
+
+
+# compiled by load_mac_table() for the commands classifying many MACs: a one-shot
+# command looking up a single MAC is faster with the regex scan than with the compile
+macTableStarts, macTableModels = None, None
+_mac_table_failed = False
+
+
+def load_mac_table():
+    """ Compile the MAC range table unless done already. Returns False if the rules cannot be
+    compiled: the regex scan is used then. """
+    global macTableStarts, macTableModels, _mac_table_failed
+    if macTableStarts is None and not _mac_table_failed:
+        try:
+            starts, phones = _compile_mac_table(macRegexList)
+        except ValueError:
+            # a rule the compiler does not understand: keep using the regex scan
+            _mac_table_failed = True
+            return False
+        # readers test macTableStarts: set it last
+        macTableModels = phones
+        macTableStarts = starts
+    return macTableStarts is not None
+
+server = None
+username = ""
+banner = None
+
+local_vars = {}
+
+# Compression
+#
+# Request bodies larger than the 'compress' default (in bytes) are sent gzip
+# encoded and gzip encoded responses are accepted; 'defaults compress 0' turns
+# both off. Once the server refused a compressed request (HTTP 400, 415 or
+# 501) or failed to parse it (a server ignoring the Content-Encoding), the
+# request is sent again uncompressed, and so are the next ones of the session.
+
+GZIP_REFUSED_ERRORS = (400, 415, 501)
+
+gzip_requests_supported = True
+
+
+def gzip_refused(err):
+    """ True if 'err' is the answer of a server to a gzip encoded request it does not take """
+    if isinstance(err, ProtocolError):
+        return err.errcode in GZIP_REFUSED_ERRORS
+    if isinstance(err, Fault):
+        # -32700: "parse error, not well formed" of the XML-RPC fault code interoperability spec;
+        # Python servers report the ExpatError of the request instead
+        return err.faultCode == -32700 or "ExpatError" in str(err.faultString)
+    return False
+
+
+def get_compress_threshold():
+    try:
+        return max(0, int(defaults["compress"]))
+    except ValueError:
+        return 0
+
+
+def gzip_body(data):
+    # XML compresses well even at the fastest level
+    encoder = zlib.compressobj(1, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return encoder.compress(data) + encoder.flush()
+
+
+class DecodedResponse(object):
+    """ File-like view of an HTTP response body, gunzipped if it is gzip encoded, adding the
+    bytes read off the wire and the decoded bytes to counts[0] and counts[1] """
+
+    def __init__(self, response, counts):
+        self.response = response
+        self.counts = counts
+        if response.getheader("Content-Encoding", "") == "gzip":
+            self.decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            self.decoder = None
+
+    def read(self, size=16384):
+        while True:
+            data = self.response.read(size)
+            self.counts[0] += len(data)
+            if self.decoder is not None:
+                decoded = self.decoder.decompress(data) if data else self.decoder.flush()
+                if data and not decoded:
+                    # the chunk did not complete a compressed block yet
+                    continue
+                data = decoded
+            self.counts[1] += len(data)
+            return data
+
+
+class HTTPSSafeAuth(SafeTransport):
+    def __init__(self, user, password, *l, **kw):
+        SafeTransport.__init__(self, *l, **kw)
+        self.user = user
+        self.password = password
+        # the headers are the same for every request: encode them once
+        if sys.version_info > (3, 0):
+            auth = b64encode(bytes(self.user + ':' + self.password, "utf-8")).decode("ascii")
+            # Python 3 sends the Content-Type in send_request()
+            self._headers_once = [('Authorization', 'Basic %s' % auth)]
+        else:
+            auth = b64encode(self.user + ':' + self.password)
+            self._headers_once = [('Content-Type', 'text/xml'), ('Authorization', 'Basic %s' % auth)]
+        self.accept_gzip_encoding = get_compress_threshold() > 0
+
+    def encode_content(self, request_body):
+        """ Return the request body to send, gzip encoded if it is over the 'compress' threshold """
+        threshold = get_compress_threshold()
+        if threshold and gzip_requests_supported and len(request_body) > threshold:
+            return gzip_body(request_body), True
+        return request_body, False
+
+    def send_content(self, connection, request_body):
+        request_body, compressed = self.encode_content(request_body)
+        for name, value in self._headers_once:
+            connection.putheader(name, value)
+        if compressed:
+            connection.putheader('Content-Encoding', 'gzip')
+        connection.putheader("Content-Length", str(len(request_body)))
+        if sys.version_info >= (2, 7):
+            # headers and body in one segment: no Nagle / delayed ACK stall between them
+            connection.endheaders(request_body)
+        else:
+            connection.endheaders()
+            if request_body:
+                connection.send(request_body)
+
+# Transport
+#
+# All ServerProxy objects of a session share one SSLContext and, per endpoint
+# and user, one pool of keep-alive HTTPS connections. Each request borrows a
+# connection from the pool, so a single proxy can be used from many threads and
+# concurrent commands reuse open connections (and TLS sessions) instead of
+# paying a TCP+TLS handshake each.
+
+_ssl_context = None
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_ssl_context():
+    """ Return the SSLContext shared by all connections """
+    global _ssl_context
+    if _ssl_context is None:
+        _ssl_context = ssl._create_unverified_context()
+    return _ssl_context
+
+
+class PooledHTTPSConnection(HttpClient.HTTPSConnection):
+    """ HTTPS connection resuming the TLS session of its pool and counting how often it is reused """
+
+    def __init__(self, host, pool):
+        HttpClient.HTTPSConnection.__init__(self, host, context=pool.context)
+        self.pool = pool
+        self.requests = 0
+        self.handshakes = 0
+        self.resumed = 0
+
+    def connect(self):
+        kw = {}
+        if self.pool.tls_session is not None:
+            kw["session"] = self.pool.tls_session
+        try:
+            HttpClient.HTTPConnection.connect(self)
+            self.sock = self.pool.context.wrap_socket(self.sock, server_hostname=self.host, **kw)
+        except socket.error as err:
+            # nothing was sent: the request can be sent again whatever it does
+            err.before_request = True
+            raise
+        self.handshakes += 1
+        if getattr(self.sock, "session_reused", False):
+            self.resumed += 1
+        self.pool.save_session(self)
+
+
+def connection_dropped(conn):
+    """ True if the server closed the idle keep-alive connection 'conn': an idle connection
+    only becomes readable with the end of the stream (or garbage) """
+    if conn.sock is None:
+        return False
+    try:
+        return bool(select.select([conn.sock], [], [], 0)[0])
+    except (ValueError, socket.error):
+        return True
+
+
+class ConnectionPool(object):
+    """ Thread-safe pool of keep-alive HTTPS connections to one host """
+
+    def __init__(self, host, maxsize=None):
+        self.host = host
+        self.maxsize = maxsize
+        self.context = get_ssl_context()
+        self.tls_session = None
+        self.connections = []
+        self.retired = []
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self._idle:
+                conn = self._idle.pop()
+                if connection_dropped(conn):
+                    # reconnect rather than find out by failing the request
+                    conn.close()
+                return conn
+            conn = PooledHTTPSConnection(self.host, self)
+            self.connections.append(conn)
+            return conn
+
+    def release(self, conn):
+        self.save_session(conn)
+        with self._lock:
+            if len(self._idle) < (self.maxsize or get_workers() + 1):
+                self._idle.append(conn)
+                return
+            self.connections.remove(conn)
+            self.retired.append((conn.requests, conn.handshakes, conn.resumed))
+        conn.close()
+
+    def save_session(self, conn):
+        # TLS 1.3 tickets only arrive after the handshake: refresh after each request
+        session = getattr(conn.sock, "session", None)
+        if session is not None:
+            self.tls_session = session
+
+    def stats(self):
+        """ Return (requests, handshakes, resumed handshakes) for every connection of the pool """
+        with self._lock:
+            return self.retired + [(c.requests, c.handshakes, c.resumed) for c in self.connections]
+
+    def close(self):
+        with self._lock:
+            for conn in self._idle:
+                conn.close()
+
+
+def get_pool(host, user):
+    """ Return the connection pool for 'host' and 'user', creating it on first use """
+    with _pools_lock:
+        pool = _pools.get((host, user))
+        if pool is None:
+            pool = _pools[(host, user)] = ConnectionPool(host)
+        return pool
+
+
+def print_pool_stats():
+    for (host, user), pool in sorted(_pools.items()):
+        stats = pool.stats()
+        requests = sum(s[0] for s in stats)
+        handshakes = sum(s[1] for s in stats)
+        resumed = sum(s[2] for s in stats)
+        print("%s (%s): %d connections, %d requests, %d TLS handshakes (%d resumed)" % (
+            host, user, len(stats), requests, handshakes, resumed))
+        for n, (requests, handshakes, resumed) in enumerate(stats):
+            print("  #%d: %d requests, %d handshakes, %d resumed" % (n, requests, handshakes, resumed))
+
+
+# RPC instrumentation
+#
+# Every XML-RPC request going through a PooledTransport (or the asyncio
+# client) is recorded per method: calls, errors (transport failures and
+# faults), rejected calls (a [False, "Error:..."] result), request and
+# response bytes on the wire and as uncompressed XML, and a latency
+# histogram. 'stats' prints them,
+# SNOM_STATS=<file> writes them at exit, as Prometheus text format if the
+# file ends with .prom and as JSON otherwise.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class MethodStats(object):
+    """ Counters of one XML-RPC method """
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.rejected = 0
+        self.sent = 0
+        self.received = 0
+        self.sent_xml = 0       # before compression
+        self.received_xml = 0   # after decompression
+        self.seconds = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)   # the last one is +Inf
+
+    def quantile(self, q):
+        """ Upper bound of the latency bucket holding the 'q' quantile """
+        rank = q * self.calls
+        count = 0
+        for bound, n in zip(LATENCY_BUCKETS, self.buckets):
+            count += n
+            if count >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class RpcStats(object):
+    """ Thread-safe per-method RPC counters """
+
+    def __init__(self):
+        self.methods = {}
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def record(self, method, seconds, sent, received, error=False, rejected=False, sent_xml=None, received_xml=None):
+        """ Count a request of 'sent' and 'received' bytes on the wire, and of 'sent_xml' and
+        'received_xml' bytes of uncompressed XML (by default the same) """
+        with self._lock:
+            stats = self.methods.get(method)
+            if stats is None:
+                stats = self.methods[method] = MethodStats()
+            stats.calls += 1
+            stats.errors += bool(error)
+            stats.rejected += bool(rejected)
+            stats.sent += sent
+            stats.received += received
+            stats.sent_xml += sent if sent_xml is None else sent_xml
+            stats.received_xml += received if received_xml is None else received_xml
+            stats.seconds += seconds
+            stats.max = max(stats.max, seconds)
+            stats.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    def reset(self):
+        with self._lock:
+            self.methods = {}
+            self.started = time.time()
+
+    def lines(self):
+        """ Human readable table of the counters """
+        lines = ["%-30s %8s %6s %8s %10s %10s %8s %8s %8s %8s" % (
+            "method", "calls", "errors", "rejected", "sent", "received", "mean ms", "p50 ms", "p99 ms", "max ms")]
+        with self._lock:
+            for method, stats in sorted(self.methods.items()):
+                lines.append("%-30s %8d %6d %8d %10d %10d %8.1f %8.1f %8.1f %8.1f" % (
+                    method, stats.calls, stats.errors, stats.rejected, stats.sent, stats.received,
+                    stats.seconds / stats.calls * 1000, stats.quantile(0.5) * 1000,
+                    stats.quantile(0.99) * 1000, stats.max * 1000))
+            methods = list(self.methods.values())
+        lines.append("%d requests in %.1fs" % (sum(s.calls for s in methods), time.time() - self.started))
+        lines.append(wire_line("sent", sum(s.sent for s in methods), sum(s.sent_xml for s in methods)) + ", " +
+                     wire_line("received", sum(s.received for s in methods), sum(s.received_xml for s in methods)))
+        return lines
+
+    def to_json(self):
+        with self._lock:
+            return json.dumps({
+                "started": self.started,
+                "duration": time.time() - self.started,
+                "buckets": list(LATENCY_BUCKETS),
+                "methods": dict((method, {
+                    "calls": stats.calls, "errors": stats.errors, "rejected": stats.rejected,
+                    "bytes_sent": stats.sent, "bytes_received": stats.received,
+                    "xml_bytes_sent": stats.sent_xml, "xml_bytes_received": stats.received_xml,
+                    "seconds": stats.seconds, "max": stats.max, "histogram": stats.buckets,
+                }) for method, stats in self.methods.items()),
+            }, indent=2, sort_keys=True)
+
+    def to_prometheus(self):
+        """ Prometheus text exposition format, for the node_exporter textfile collector """
+        counters = (("calls", "calls", "XML-RPC requests"),
+                    ("errors", "errors", "XML-RPC requests failed with a transport error or a fault"),
+                    ("rejected", "rejected", "XML-RPC requests answered with an error result"),
+                    ("sent", "sent_bytes", "XML-RPC request bytes sent"),
+                    ("received", "received_bytes", "XML-RPC response bytes received"),
+                    ("sent_xml", "sent_xml_bytes", "XML-RPC request bytes before compression"),
+                    ("received_xml", "received_xml_bytes", "XML-RPC response bytes after decompression"))
+        out = []
+        with self._lock:
+            methods = sorted(self.methods.items())
+            for attr, name, text in counters:
+                out.append("# HELP snomcli_rpc_%s_total %s" % (name, text))
+                out.append("# TYPE snomcli_rpc_%s_total counter" % name)
+                for method, stats in methods:
+                    out.append('snomcli_rpc_%s_total{method="%s"} %d' % (name, method, getattr(stats, attr)))
+            out.append("# HELP snomcli_rpc_latency_seconds XML-RPC request latency")
+            out.append("# TYPE snomcli_rpc_latency_seconds histogram")
+            for method, stats in methods:
+                count = 0
+                for bound, n in zip(LATENCY_BUCKETS + ("+Inf",), stats.buckets):
+                    count += n
+                    out.append('snomcli_rpc_latency_seconds_bucket{method="%s",le="%s"} %d' % (method, bound, count))
+                out.append('snomcli_rpc_latency_seconds_sum{method="%s"} %f' % (method, stats.seconds))
+                out.append('snomcli_rpc_latency_seconds_count{method="%s"} %d' % (method, stats.calls))
+        return "\n".join(out) + "\n"
+
+    def export(self, path, fmt=None):
+        """ Write the counters to 'path' atomically as "json" or "prometheus", by default
+        as Prometheus text format if the file name ends with .prom """
+        if fmt is None:
+            fmt = "prometheus" if path.endswith(".prom") else "json"
+        data = self.to_prometheus() if fmt == "prometheus" else self.to_json() + "\n"
+        tmp = "%s.tmp" % path
+        with open(tmp, "w") as statsfile:
+            statsfile.write(data)
+        os.rename(tmp, path)
+
+
+rpc_stats = RpcStats()
+
+
+def wire_line(label, wire, xml):
+    """ Eg. "sent 1200 bytes for 4800 bytes of XML (75% saved)" """
+    return "%s %d bytes for %d bytes of XML (%.0f%% saved)" % (label, wire, xml, 100.0 * (xml - wire) / xml if xml else 0)
+
+
+def rpc_method(request_body):
+    """ Name of the method called by an XML-RPC request body """
+    start = request_body.find(b"<methodName>")
+    if start < 0:
+        return "unknown"
+    end = request_body.find(b"</methodName>", start)
+    return request_body[start + 12:end].decode("ascii", "replace")
+
+
+def is_rejected(result):
+    return isinstance(result, list) and result[:1] == [False]
+
+
+# Request scheduling
+#
+# Every request of the session passes through one Scheduler, whichever
+# command or backend issued it:
+# - a token bucket caps the request rate ('defaults ratelimit <n>' requests
+#   per second, 0 for no limit),
+# - transient failures are retried up to 'retries' times with exponential
+#   backoff and full jitter: requests the server refused (HTTP 429/503) or
+#   never received (connection failures) always, other connection errors and
+#   gateway errors (HTTP 502/504) only for idempotent requests, since the
+#   server may have applied a registerPhone or deregisterPhone whose response
+#   was lost,
+# - the number of requests in flight adapts AIMD style between 1 and
+#   'workers': +1/limit per success, halved on a transient failure or a
+#   latency spike, at most once per smoothed round trip.
+
+TRANSIENT_HTTP_ERRORS = (429, 502, 503, 504)
+
+
+def get_rate_limit():
+    try:
+        return max(0.0, float(defaults["ratelimit"]))
+    except ValueError:
+        return 0.0
+
+
+def get_retries():
+    try:
+        return max(0, int(defaults["retries"]))
+    except ValueError:
+        return 0
+
+
+_mutating_pattern = re.compile(b"redirect\\.(?:de)?registerPhone")
+
+
+def is_idempotent(request_body):
+    """ True if sending the request body twice has the effect of sending it once: read-only
+    calls and multicall batches of read-only calls """
+    return _mutating_pattern.search(request_body) is None
+
+
+def is_transient(err, idempotent=True):
+    """ True if a request failed with 'err' can be sent again: the server refused it (HTTP 429, 503)
+    or it never left the client. Other transport and gateway errors may hide a call the server
+    applied, they only count for 'idempotent' requests. """
+    if isinstance(err, ProtocolError):
+        return err.errcode in (429, 503) or (idempotent and err.errcode in TRANSIENT_HTTP_ERRORS)
+    if getattr(err, "before_request", False):
+        return True
+    return idempotent and isinstance(err, (HttpClient.HTTPException, socket.error, EOFError))
+
+
+class Scheduler(object):
+    """ Rate limit, retries and adaptive concurrency shared by all requests """
+
+    backoff_base = 0.25
+    backoff_max = 10.0
+    spike_factor = 4.0
+
+    def __init__(self):
+        self.limit = None        # adaptive concurrency limit, starts at 'workers'
+        self.in_flight = 0
+        self.latency = None      # smoothed latency of the successful requests
+        self.retried = 0
+        self.decreases = 0
+        self.throttled = 0.0     # seconds spent waiting for the rate limit
+        self._tokens = 0.0
+        self._refilled = time.time()
+        self._decreased = 0.0
+        self._cond = threading.Condition(threading.Lock())
+
+    def max_limit(self):
+        return float(get_workers())
+
+    def reserve(self):
+        """ Take a token from the bucket; return the seconds to wait before sending """
+        rate = get_rate_limit()
+        if not rate:
+            return 0.0
+        with self._cond:
+            now = time.time()
+            # the bucket holds at most one second worth of tokens
+            self._tokens = min(rate, self._tokens + (now - self._refilled) * rate) - 1
+            self._refilled = now
+            delay = -self._tokens / rate if self._tokens < 0 else 0.0
+            self.throttled += delay
+            return delay
+
+    def try_enter(self):
+        """ Take a concurrency slot if one is free """
+        with self._cond:
+            return self._enter()
+
+    def _enter(self):
+        if self.limit is None or self.limit > self.max_limit():
+            self.limit = self.max_limit()
+        if self.in_flight >= int(self.limit):
+            return False
+        self.in_flight += 1
+        return True
+
+    def enter(self):
+        """ Wait for a token and a concurrency slot """
+        delay = self.reserve()
+        if delay:
+            time.sleep(delay)
+        with self._cond:
+            while not self._enter():
+                self._cond.wait()
+
+    def leave(self, seconds, failed=False):
+        """ Release the slot of a request that took 'seconds' (None if its latency is not
+        meaningful), adapting the concurrency limit """
+        with self._cond:
+            self.in_flight -= 1
+            now = time.time()
+            spike = (not failed and seconds is not None and self.latency is not None and
+                     seconds > self.spike_factor * self.latency)
+            if failed or spike:
+                if now - self._decreased > (self.latency or 0.0):
+                    self.limit = max(1.0, self.limit / 2)
+                    self.decreases += 1
+                    self._decreased = now
+            else:
+                self.limit = min(self.max_limit(), self.limit + 1.0 / self.limit)
+            if not failed and seconds is not None:
+                self.latency = seconds if self.latency is None else 0.9 * self.latency + 0.1 * seconds
+            self._cond.notify_all()
+
+    def fail(self, seconds, err, attempt, idempotent=True):
+        """ Release the slot of try number 'attempt' (from 0) of a request failed with 'err'.
+        Return the seconds to wait before sending it again, None if it must not be retried. """
+        self.leave(seconds, is_transient(err))
+        if not is_transient(err, idempotent) or attempt >= get_retries():
+            return None
+        with self._cond:
+            self.retried += 1
+        # full jitter exponential backoff
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def call(self, func, idempotent=True):
+        """ Run the request func() under the rate limit and concurrency limit, retrying transient failures """
+        attempt = 0
+        while True:
+            self.enter()
+            started = time.time()
+            try:
+                result = func()
+            except Exception as err:
+                delay = self.fail(time.time() - started, err, attempt, idempotent)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self.leave(time.time() - started)
+            return result
+
+    def line(self):
+        return "scheduler: concurrency %.1f/%d, %d in flight, %d retries, %d decreases, %.1fs rate limited" % (
+            self.limit or self.max_limit(), self.max_limit(), self.in_flight, self.retried, self.decreases,
+            self.throttled)
+
+
+scheduler = Scheduler()
+
+
+class PooledTransport(HTTPSSafeAuth):
+    """ XML-RPC transport borrowing a connection from a ConnectionPool for every request """
+
+    def __init__(self, user, password, pool, *l, **kw):
+        HTTPSSafeAuth.__init__(self, user, password, *l, **kw)
+        self.pool = pool
+        self._local = threading.local()
+
+    def make_connection(self, host):
+        return self._local.conn
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+
+    def encode_content(self, request_body):
+        body, compressed = HTTPSSafeAuth.encode_content(self, request_body)
+        self._local.sent = len(body)
+        self._local.compressed = compressed
+        return body, compressed
+
+    def request(self, host, handler, request_body, verbose=False):
+        started = time.time()
+        self._local.sent = len(request_body)
+        self._local.counts = counts = [0, 0]
+        result = None
+        try:
+            result = scheduler.call(lambda: self._request(host, handler, request_body, verbose),
+                                    is_idempotent(request_body))
+            return result
+        finally:
+            rpc_stats.record(rpc_method(request_body), time.time() - started, self._local.sent, counts[0],
+                             result is None, result is not None and is_rejected(result[0]),
+                             len(request_body), counts[1])
+
+    def _request(self, host, handler, request_body, verbose=False):
+        global gzip_requests_supported
+        self._local.compressed = False
+        try:
+            return self._pooled_request(host, handler, request_body, verbose)
+        except (ProtocolError, Fault) as err:
+            # the server could not read the request: resending it is safe
+            if not self._local.compressed or not gzip_refused(err):
+                raise
+            gzip_requests_supported = False
+            return self._pooled_request(host, handler, request_body, verbose)
+
+    def _pooled_request(self, host, handler, request_body, verbose=False):
+        for attempt in (0, 1):
+            conn = self.pool.acquire()
+            # an already open connection may have been dropped by the server while idle
+            kept_alive = conn.sock is not None
+            conn.requests += 1
+            self._local.conn = conn
+            try:
+                return self.single_request(host, handler, request_body, verbose)
+            except (HttpClient.HTTPException, socket.error):
+                conn.close()
+                # the pool discards connections dropped while idle, so a failure here may come
+                # after the server processed the request: only resend what is idempotent
+                if attempt or not kept_alive or not is_idempotent(request_body):
+                    raise
+            finally:
+                self._local.conn = None
+                self.pool.release(conn)
+
+    def parse_response(self, response):
+        # decode the body here to count the response bytes both on the wire and decompressed
+        return HTTPSSafeAuth.parse_response(self, DecodedResponse(response, self._local.counts))
+
+    def stream_request(self, host, handler, request_body, verbose=False):
+        """ Like request(), but yield the raw response body in chunks as it arrives instead of parsing it """
+        started = time.time()
+        counts = [0, 0, len(request_body)]   # bytes received on the wire and decompressed, bytes sent
+        error = False
+        try:
+            attempt = 0
+            while True:
+                scheduler.enter()
+                begin = time.time()
+                chunks = self._stream_request(host, handler, request_body, verbose, counts)
+                try:
+                    # nothing was handed to the caller yet: a failure here can still be retried
+                    first = next(chunks, None)
+                except Exception as err:
+                    delay = scheduler.fail(time.time() - begin, err, attempt)
+                    if delay is None:
+                        raise
+                    time.sleep(delay)
+                    attempt += 1
+                    continue
+                # a streamed response lasts as long as the caller consumes it: its
+                # slot is released once the headers arrived, without a latency sample
+                scheduler.leave(None)
+                break
+            if first is not None:
+                yield first
+                for chunk in chunks:
+                    yield chunk
+        except Exception:
+            error = True
+            raise
+        finally:
+            rpc_stats.record(rpc_method(request_body), time.time() - started, counts[2], counts[0], error,
+                             False, len(request_body), counts[1])
+
+    def _stream_request(self, host, handler, request_body, verbose, counts):
+        for attempt in (0, 1):
+            conn = self.pool.acquire()
+            kept_alive = conn.sock is not None
+            conn.requests += 1
+            self._local.conn = conn
+            try:
+                self.send_request(host, handler, request_body, verbose)
+                counts[2] = self._local.sent
+                response = conn.getresponse()
+                break
+            except (HttpClient.HTTPException, socket.error):
+                conn.close()
+                self.pool.release(conn)
+                if attempt or not kept_alive:
+                    raise
+            finally:
+                self._local.conn = None
+        complete = False
+        try:
+            if response.status != 200:
+                response.read()
+                complete = True
+                raise ProtocolError(host + handler, response.status, response.reason, response.msg)
+            body = DecodedResponse(response, counts)
+            while True:
+                chunk = body.read(16384)
+                if not chunk:
+                    break
+                yield chunk
+            complete = True
+        finally:
+            # a response abandoned half-way leaves the connection unusable
+            if not complete:
+                conn.close()
+            self.pool.release(conn)
+
+
+class StreamingUnmarshaller(Unmarshaller):
+    """ Unmarshaller handing each element of the top-level result array to 'callback' as soon
+    as it is decoded, instead of building the whole list """
+
+    def __init__(self, callback):
+        Unmarshaller.__init__(self)
+        self._callback = callback
+        self._fault = False
+        self._streaming = False
+        self._push = self.append
+        self.append = self._append
+
+    def start(self, tag, attrs, *args):
+        if tag == "fault":
+            self._fault = True
+        elif tag in ("array", "struct") and not self._marks:
+            self._streaming = tag == "array" and not self._fault
+        Unmarshaller.start(self, tag, attrs, *args)
+
+    def _append(self, value):
+        if self._streaming and len(self._marks) == 1:
+            self._callback(value)
+        else:
+            self._push(value)
+
+
+# Util
+
+# the SNOM_URL environment variable points the console to another server (Eg. a local stand-in)
+rpc_url = os.environ.get("SNOM_URL", 'https://secure-provisioning.snom.com:8083/xmlrpc/')
+
+
+def split_rpc_url(url):
+    """ Return the host[:port] and the path of the endpoint 'url', the path defaulting to "/" """
+    parts = urlsplit(url)
+    path = parts.path or "/"
+    if parts.query:
+        path += "?" + parts.query
+    return parts.netloc, path
+
+
+def make_rpc_conn(user, passwd):
+    if "SNOM_DEBUG" in os.environ:
+        debug = True
+    else:
+        debug = False
+    host, path = split_rpc_url(rpc_url)
+    # without a path ServerProxy would post to /RPC2
+    url = "%s://%s%s" % (urlsplit(rpc_url).scheme, host, path)
+    if sys.version_info > (2, 7):
+        pool = get_pool(host, user)
+        transport = PooledTransport(user, passwd, pool)
+        transport.endpoint = (host, path)
+        return ServerProxy(url, transport=transport, verbose=debug, allow_none=True)
+    else:  # Python 2.6 compatible:
+        transport = HTTPSSafeAuth(user, passwd)
+        return ServerProxy(url, transport=transport, verbose=debug, allow_none=True)
+
+
+# Bulk operations
+
+_server_lock = threading.Lock()
+
+
+def get_server():
+    """ Return the RPC connection of the session, or of the account the thread works for (see
+    set_account()). Its pooled transport makes it safe to share between threads. """
+    global server
+    account = current_account()
+    if account is not None:
+        return account.get_server()
+    if server is None:
+        with _server_lock:
+            if server is None:
+                server = make_rpc_conn(defaults["username"], defaults["password"])
+    return server
+
+
+def get_workers():
+    """ Number of concurrent RPC workers used by bulk commands (see 'defaults workers <n>'). """
+    try:
+        return max(1, int(defaults["workers"]))
+    except ValueError:
+        return 1
+
+
+def run_parallel(func, items, workers=None):
+    """ Call func(item) for every element of 'items' on a bounded pool of worker threads.
+    'items' is consumed lazily, so arbitrarily large inputs are streamed. Yields
+    (item, result, exception) tuples in completion order. """
+    if workers is None:
+        workers = get_workers()
+    tasks = Queue.Queue(workers * 2)
+    results = Queue.Queue()
+    done = object()
+    feed_error = []
+    account = current_account()
+    mode = get_cache_mode()
+
+    def feed():
+        set_account(account)
+        set_cache_mode(mode)
+        try:
+            for item in items:
+                tasks.put(item)
+        except Exception as err:
+            feed_error.append(err)
+        finally:
+            for _ in range(workers):
+                tasks.put(done)
+
+    def work():
+        set_account(account)
+        set_cache_mode(mode)
+        while True:
+            item = tasks.get()
+            if item is done:
+                results.put(done)
+                return
+            try:
+                results.put((item, func(item), None))
+            except Exception as err:
+                results.put((item, None, err))
+
+    threads = [threading.Thread(target=feed)] + [threading.Thread(target=work) for _ in range(workers)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    running = workers
+    while running:
+        result = results.get()
+        if result is done:
+            running -= 1
+        else:
+            yield result
+    if feed_error:
+        raise feed_error[0]
+
+
+def get_backend():
+    """ Concurrency backend of bulk commands: "threads" or, on Python 3, "asyncio" (see 'defaults backend <name>'). """
+    if defaults["backend"] == "asyncio" and sys.version_info >= (3, 5):
+        return "asyncio"
+    return "threads"
+
+
+def run_async(func, items, workers=None):
+    """ asyncio counterpart of run_parallel(). For every element of 'items', func(item) returns
+    the (method, args) of the AsyncRedirectionClient operation to run, or (None, result) when
+    no request is needed. The event loop runs in a background thread, at most 'workers'
+    requests in flight; yields (item, result, exception) tuples in completion order. """
+    import aioclient
+    if workers is None:
+        workers = get_workers()
+    results = Queue.Queue()
+    done = object()
+    loop_error = []
+    account = current_account()
+    mode = get_cache_mode()
+    user, password = (account.username, account.password) if account else (defaults["username"], defaults["password"])
+
+    def calls():
+        for item in items:
+            method, args = func(item)
+            if method is None:
+                results.put((item, args, None))
+            else:
+                yield item, method, args
+
+    def run():
+        set_account(account)
+        set_cache_mode(mode)
+        try:
+            client = aioclient.AsyncRedirectionClient(rpc_url, user, password,
+                                                      limit=workers, ssl_context=get_ssl_context(),
+                                                      stats=rpc_stats, scheduler=scheduler,
+                                                      compress=get_compress_threshold() or None)
+            aioclient.run_bulk(client, calls(), lambda *result: results.put(result), workers)
+        except Exception as err:
+            loop_error.append(err)
+        finally:
+            results.put(done)
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    while True:
+        result = results.get()
+        if result is done:
+            break
+        yield result
+    if loop_error:
+        raise loop_error[0]
+
+
+def run_direct(func, items):
+    """ Sequential counterpart of run_parallel(), for inputs too small to be worth a thread pool """
+    for item in items:
+        try:
+            yield item, func(item), None
+        except Exception as err:
+            yield item, None, err
+
+
+def run_ordered(func, items, workers=None):
+    """ Like run_parallel(), but yield the (item, result, exception) tuples in the order of 'items' """
+    pending = {}
+    position = 0
+    for (index, item), result, err in run_parallel(lambda task: func(task[1]), enumerate(items), workers):
+        pending[index] = (item, result, err)
+        while position in pending:
+            yield pending.pop(position)
+            position += 1
+
+
+def error_code(res=None, err=None):
+    """ Return the error code of a failed RPC result or exception, suitable for error_message(). """
+    if err is not None:
+        if isinstance(err, Fault):
+            return "%s" % err.faultString
+        if isinstance(err, ProtocolError):
+            return "%d %s" % (err.errcode, err.errmsg)
+        if isinstance(err, Error):
+            return "%s" % err.__class__.__name__
+        return "%s: %s" % (err.__class__.__name__, err)
+    if res and len(res) == 2:
+        return res[1]
+    return "%s" % (res,)
+
+
+def get_batch_size():
+    """ Number of calls sent in a single system.multicall request (see 'defaults batchsize <n>'). """
+    try:
+        return max(1, int(defaults["batchsize"]))
+    except ValueError:
+        return 1
+
+
+def chunks(items, size):
+    """ Split an iterable into lists of at most 'size' elements """
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# set to False once the server refused a system.multicall request
+multicall_supported = True
+
+
+def multicall_refused(err):
+    """ True if 'err' is the fault of a server without system.multicall """
+    if not isinstance(err, Fault):
+        return False
+    # -32601: "requested method not found" of the XML-RPC fault code interoperability spec
+    return err.faultCode == -32601 or "system.multicall" in str(err.faultString)
+
+
+def multicall(method, calls, batch_size=None):
+    """ Run 'method' (Eg. "redirect.getPhoneRedirection") once for every argument tuple of 'calls'.
+    The calls are sent in system.multicall batches of 'batch_size', several batches in parallel;
+    if the server does not support multicall they fall back to parallel single calls.
+    Returns the list of results in the order of 'calls', None for each failed call. """
+    global multicall_supported
+    calls = list(calls)
+    results = [None] * len(calls)
+    if batch_size is None:
+        batch_size = get_batch_size()
+
+    def single(index):
+        conn = get_server()
+        for name in method.split("."):
+            conn = getattr(conn, name)
+        return conn(*calls[index])
+
+    def batch(indexes):
+        mc = MultiCall(get_server())
+        call = mc
+        for name in method.split("."):
+            call = getattr(call, name)
+        for index in indexes:
+            call(*calls[index])
+        response = mc()
+        values = []
+        for n in range(len(indexes)):
+            try:
+                values.append(response[n])
+            except Error:
+                values.append(None)
+        return values
+
+    indexes = list(range(len(calls)))
+    pending = indexes
+    if multicall_supported and len(calls) > 1:
+        pending = []
+        if len(calls) <= batch_size:
+            batches = run_direct(batch, [indexes])
+        else:
+            batches = run_parallel(batch, chunks(indexes, batch_size))
+        for batch_indexes, values, err in batches:
+            if err is None:
+                for index, value in zip(batch_indexes, values):
+                    results[index] = value
+            else:
+                if multicall_refused(err):
+                    multicall_supported = False
+                pending.extend(batch_indexes)
+    if len(pending) > 1:
+        singles = run_parallel(single, pending)
+    else:
+        singles = run_direct(single, pending)
+    for index, value, err in singles:
+        if err is None:
+            results[index] = value
+    return results
+
+
+def iter_list_phones(model, url=None):
+    """ Yield the values of listPhones(model, url) as they are decoded from the response,
+    without holding the whole reply in memory. """
+    proxy = get_server()
+    transport = proxy("transport")
+    if not hasattr(transport, "stream_request") or sys.version_info < (3, 0):
+        for value in proxy.redirect.listPhones(model, url):
+            yield value
+        return
+    values = []
+    unmarshaller = StreamingUnmarshaller(values.append)
+    parser = ExpatParser(unmarshaller)
+    body = dumps((model, url), "redirect.listPhones", allow_none=True).encode("utf-8", "xmlcharrefreplace")
+    host, handler = transport.endpoint
+    for chunk in transport.stream_request(host, handler, body, "SNOM_DEBUG" in os.environ):
+        parser.feed(chunk)
+        for value in values:
+            yield value
+        del values[:]
+    parser.close()
+    unmarshaller.close()
+    for value in values:
+        yield value
+
+
+def iter_phones(model_list, url=None, errors=None, fresh=False):
+    """ Yield the MACs of every model of 'model_list', model by model in the given order.
+    A single model is streamed while its listPhones response is decoded, several models are
+    listed concurrently. Models listed within the cache TTL come from the inventory cache,
+    unless 'fresh' is set. Failed listings are recorded in the 'errors' dictionary as model -> error code. """
+    inv = get_inventory()
+    if errors is None:
+        errors = {}
+
+    def cached(model):
+        if url is None and not fresh:
+            return inv.listing(model)
+        return None
+
+    def fetch(model):
+        macs = cached(model)
+        if macs is not None:
+            return macs, False
+        return list(iter_list_phones(model, url)), True
+
+    if len(model_list) == 1:
+        macs = cached(model_list[0])
+        if macs is not None:
+            sources = [(model_list[0], (macs, False), None)]
+        else:
+            sources = [(model_list[0], (iter_list_phones(model_list[0], url), True), None)]
+    else:
+        sources = run_ordered(fetch, model_list)
+
+    for model, result, err in sources:
+        if err is not None:
+            errors[model] = error_code(err=err)
+            continue
+        values, fetched = result
+        values = iter(values)
+        macs = []
+        try:
+            for mac in values:
+                if mac is False:
+                    # error result: [False, "Error:..."]
+                    rest = list(values)
+                    errors[model] = rest[0] if rest else "Error"
+                    break
+                if fetched:
+                    macs.append(mac)
+                yield mac
+            else:
+                if fetched and url is None:
+                    inv.store_listing(model, macs)
+        except (Error, HttpClient.HTTPException, socket.error) as err:
+            errors[model] = error_code(err=err)
+
+
+def list_phones(model_list, url=None, fresh=False):
+    """ Run listPhones for every model of 'model_list' concurrently, answering from the
+    inventory cache for the models listed within the cache TTL unless 'fresh' is set.
+    Returns a (phones, errors) tuple: the MACs merged in the order of 'model_list'
+    and a dictionary of model -> error code for the queries that failed. """
+    errors = {}
+    phones = list(iter_phones(model_list, url, errors, fresh))
+    return phones, errors
+
+
+def inventory_models(path):
+    """ Return the phone models appearing in a local inventory file of 'mac[,url]' rows """
+    present = set(classify_many(mac for mac, url in read_mac_csv(path)))
+    return [model for model in models if model in present]
+
+
+class Progress(object):
+    """ Live progress and throughput counter for bulk commands """
+
+    def __init__(self, label, total=None, interval=0.5):
+        self.label = label
+        self.total = total
+        self.interval = interval
+        self.count = 0
+        self.started = time.time()
+        self._shown = 0
+        self._tty = sys.stdout.isatty()
+
+    def rate(self):
+        elapsed = time.time() - self.started
+        return self.count / elapsed if elapsed > 0 else 0.0
+
+    def line(self):
+        if self.total:
+            return "%s: %d/%d (%.1f/s)" % (self.label, self.count, self.total, self.rate())
+        return "%s: %d (%.1f/s)" % (self.label, self.count, self.rate())
+
+    def update(self, n=1):
+        self.count += n
+        now = time.time()
+        if self._tty and now - self._shown >= self.interval:
+            self._shown = now
+            sys.stdout.write("\r%s" % self.line())
+            sys.stdout.flush()
+
+    def message(self, text):
+        """ Print a line without garbling the progress counter """
+        if self._tty:
+            sys.stdout.write("\r%s\r" % (" " * len(self.line())))
+        print(text)
+
+    def finish(self):
+        if self._tty:
+            sys.stdout.write("\r")
+        print("%s in %.1fs" % (self.line(), time.time() - self.started))
+
+
+def sync_plan(desired, current, skipped=()):
+    """ Compare the desired and current redirections, both dictionaries of mac -> url.
+    The MACs of 'skipped' (rows of the desired state that could not be used) are never removed.
+    Returns the (add, change, remove, unchanged) lists of MACs. """
+    add = []
+    change = []
+    unchanged = []
+    for mac in sorted(desired):
+        if mac not in current:
+            add.append(mac)
+        elif current[mac] != desired[mac]:
+            change.append(mac)
+        else:
+            unchanged.append(mac)
+    remove = sorted(mac for mac in current if mac not in desired and mac not in skipped)
+    return add, change, remove, unchanged
+
+
+class WatchSchedule(object):
+    """ Poll times of watched MACs: the interval of a MAC doubles, up to 'longest', every poll
+    finding it unchanged and falls back to 'shortest' when it changed """
+
+    def __init__(self, shortest, longest):
+        self.shortest = shortest
+        self.longest = longest
+        self.intervals = {}
+        self._heap = []
+
+    def __len__(self):
+        return len(self.intervals)
+
+    def add(self, mac, due):
+        if mac not in self.intervals:
+            self.intervals[mac] = self.shortest
+            heapq.heappush(self._heap, (due, mac))
+
+    def next_time(self):
+        return self._heap[0][0] if self._heap else None
+
+    def due(self, now):
+        """ Remove and return the MACs to poll at 'now' """
+        macs = []
+        while self._heap and self._heap[0][0] <= now:
+            macs.append(heapq.heappop(self._heap)[1])
+        return macs
+
+    def polled(self, mac, now, changed=False, failed=False):
+        """ Schedule the next poll of 'mac'; a failed poll is retried at the same interval """
+        if changed:
+            self.intervals[mac] = self.shortest
+        elif not failed:
+            self.intervals[mac] = min(self.longest, self.intervals[mac] * 2)
+        heapq.heappush(self._heap, (now + self.intervals[mac], mac))
+
+
+def redirection_state(redirection):
+    """ Return the watched (state, company, url) of a getPhoneRedirection result: state is
+    "registered" or the error code, company and url are None when not registered """
+    if redirection[0] == True:
+        return ("registered", redirection[1] or '', redirection[2] or '')
+    return (redirection[1] if len(redirection) > 1 else "%s" % (redirection,), None, None)
+
+
+def print_error_summary(errors):
+    """ Print a per-error-code summary of a bulk operation """
+    if not errors:
+        return
+    mark_failed()
+    print("Errors:")
+    for code in sorted(errors, key=lambda c: -errors[c]):
+        print("  %6d  %s" % (errors[code], error_message(code)))
+
+
+def read_mac_csv(path):
+    """ Stream (mac, url) tuples from a CSV file of 'mac[,url]' rows.
+    Blank lines, comments and a leading 'mac' header are skipped. """
+    with open(path) as csvfile:
+        for row in csv.reader(csvfile):
+            if not row or not row[0].strip() or row[0].lstrip().startswith("#"):
+                continue
+            mac = row[0].strip()
+            if mac.lower() == "mac":
+                continue
+            url = row[1].strip() if len(row) > 1 else ""
+            yield mac.upper(), url
+
+
+def validate_mac(mac, verbose=True):
+    # not a snom MAC (see SNOM_PREFIXES)
+    if mac[:6].upper() not in ("000413", "00087B"):
+        return False
+
+    # unknown phone type
+    if not (get_type(mac) if verbose else classify_mac(mac)):
+        return False
+
+    # remaining part is not a HEX number
+    try:
+        binascii.a2b_hex(mac[8:])
+    except TypeError:
+        return False
+    return True
+
+
+def get_type(mac):
+    """ The function converts the given 'mac' address into the appropriate phone type respectively. """
+    phone = classify_mac(mac)
+    if not phone:
+        print("Unknown device type (maybe not a snom MAC?): %s" % (mac.upper() if mac and len(mac) == 12 else mac))
+    return phone
+
+
+def classify_mac(mac):
+    """ Return the phone type of the given 'mac' address, or None if it is unknown. Nothing is printed. """
+    if not mac or len(mac) != 12:
+        return None
+    mac = mac.upper()
+    if not macPattern.match(mac):
+        return None
+    if macTableStarts is None:
+        for regex, phone in macRegexList:
+            if regex.match(mac):
+                return phone
+        return None
+    return macTableModels[bisect.bisect_right(macTableStarts, int(mac, 16)) - 1]
+
+
+def classify_many(macs):
+    """ Classify an iterable of MAC addresses, returning the list of phone types (None for unknown MACs). """
+    if not load_mac_table():
+        return [classify_mac(mac) for mac in macs]
+    starts = macTableStarts
+    phones = macTableModels
+    match = macPattern.match
+    search = bisect.bisect_right
+    result = []
+    append = result.append
+    for mac in macs:
+        if mac and len(mac) == 12:
+            mac = mac.upper()
+            if match(mac):
+                append(phones[search(starts, int(mac, 16)) - 1])
+                continue
+        append(None)
+    return result
+
+
+# MAC notations: 000413AABBCC, 00:04:13:aa:bb:cc, 00-04-13-AA-BB-CC, 0004.13aa.bbcc
+macHexPattern = re.compile("^[0-9A-Fa-f]{12}$")
+
+
+def normalize_mac(text):
+    """ Return 'text' as a bare uppercase 12 digit MAC, or None if it is not a MAC in a known notation """
+    mac = text.strip().replace(":", "").replace("-", "").replace(".", "")
+    if not macHexPattern.match(mac):
+        return None
+    return mac.upper()
+
+
+class MacSet(object):
+    """ Set of integer MAC addresses, one bitmap (2 MiB) per 24 bit vendor prefix """
+
+    def __init__(self):
+        self.bitmaps = {}
+        self.count = 0
+
+    def add(self, value):
+        """ Add the MAC 'value', return False if it was already in the set """
+        bitmap = self.bitmaps.get(value >> 24)
+        if bitmap is None:
+            bitmap = self.bitmaps[value >> 24] = bytearray(1 << 21)
+        index = (value >> 3) & 0x1FFFFF
+        bit = 1 << (value & 7)
+        if bitmap[index] & bit:
+            return False
+        bitmap[index] |= bit
+        self.count += 1
+        return True
+
+    def __contains__(self, value):
+        bitmap = self.bitmaps.get(value >> 24)
+        return bitmap is not None and bool(bitmap[(value >> 3) & 0x1FFFFF] & (1 << (value & 7)))
+
+    def __len__(self):
+        return self.count
+
+
+SNOM_PREFIXES = (0x000413, 0x00087B)
+
+
+def scan_macs(lines, seen=None):
+    """ Normalize, classify and deduplicate the MACs of an iterable of 'mac[,anything]' lines.
+    Yields (line, mac, model, error) for every line that is not blank, a comment or a 'mac'
+    header: 'mac' is the normalized MAC (None if malformed) and 'error' None or an error code.
+    Duplicates are detected with the MacSet 'seen', so memory does not grow with the input. """
+    if seen is None:
+        seen = MacSet()
+    load_mac_table()
+    starts = macTableStarts
+    phones = macTableModels
+    search = bisect.bisect_right
+    match = macHexPattern.match
+    add = seen.add
+    for line in lines:
+        line = line.rstrip("\r\n")
+        text, sep, rest = line.partition(",")
+        text = text.strip()
+        if not text or text.startswith("#") or text.lower() == "mac":
+            continue
+        mac = text.replace(":", "").replace("-", "").replace(".", "")
+        if not match(mac):
+            yield line, None, None, "Error:malformed_mac"
+            continue
+        mac = mac.upper()
+        value = int(mac, 16)
+        if value >> 24 not in SNOM_PREFIXES:
+            yield line, mac, None, "Error:unknown_model"
+            continue
+        model = phones[search(starts, value) - 1] if starts is not None else classify_mac(mac)
+        if not model:
+            yield line, mac, None, "Error:unknown_model"
+        elif not add(value):
+            yield line, mac, model, "Error:duplicate_mac"
+        else:
+            yield line, mac, model, None
+
+
+# outcome of the command running in the current thread (see RedirectionCli.onecmd)
+_command_status = threading.local()
+
+
+def mark_failed():
+    _command_status.failed = True
+
+
+def command_failed():
+    return getattr(_command_status, "failed", False)
+
+
+def print_failure(message):
+    """ Print an error message and mark the running command as failed """
+    print(message)
+    mark_failed()
+
+
+def set_var(name, value):
+    local_vars[name] = value
+
+
+def get_var(name):
+    if name in local_vars:
+        return local_vars[name]
+    else:
+        print("unknown variable %s" % name)
+        return None
+
+
+def print_error(res):
+    mark_failed()
+    if len(res) == 2:
+        print(error_message(res[1]))
+    else:
+        print(res)
+
+
+def store_defaults():
+    homedir = os.path.expanduser('~')
+    file = open("%s/.snomcli" % homedir, "w")
+    file.write("\n".join(["%s|%s" % (x, defaults[x]) for x in defaults]))
+    if defaults["savelocals"]:
+        file.write("\n=====\n")
+        file.write("\n".join(["%s|%s" % (x, local_vars[x])
+                              for x in local_vars]))
+    file.close()
+
+
+def load_defaults():
+    homedir = os.path.expanduser('~')
+    try:
+        file = open("%s/.snomcli" % homedir, "r")
+    except IOError:
+        return
+    line = ""
+    is_defaults = True
+    for line in file.readlines():
+        try:
+            if line == "=====\n":
+                is_defaults = False
+                continue
+            (name, value) = line.split("|", 1)
+            if is_defaults == False:
+                local_vars[name] = value.strip()
+            else:
+                defaults[name] = value.strip()
+        except Error:
+            pass
+
+
+# Inventory cache
+#
+# listPhones and getPhoneRedirection results are kept in ~/.snomcli_inventory,
+# indexed by MAC. Read commands answer from entries younger than the 'cachettl'
+# default (in seconds) and only ask the server for the rest; write commands
+# update or invalidate the entries they touch.
+
+# "auto" uses entries within the TTL, "cached" any entry, "fresh" none. The mode
+# is per command: thread-local, inherited by the worker threads of the command.
+_cache_mode = threading.local()
+
+
+def get_cache_mode():
+    return getattr(_cache_mode, "value", "auto")
+
+
+def set_cache_mode(mode):
+    _cache_mode.value = mode
+
+
+def get_cache_ttl():
+    try:
+        return float(defaults["cachettl"])
+    except ValueError:
+        return 0.0
+
+
+try:
+    array.array("Q")
+    MAC_TYPECODE = "Q"
+except ValueError:  # Python 2: 'L' is 64 bits on LP64 platforms
+    MAC_TYPECODE = "L"
+
+
+class StringTable(object):
+    """ Interned strings numbered from 1, code 0 stands for None """
+
+    def __init__(self, strings=()):
+        self.strings = [None]
+        self.codes = {}
+        for string in strings:
+            self.code(string)
+
+    def code(self, string):
+        if string is None:
+            return 0
+        code = self.codes.get(string)
+        if code is None:
+            code = self.codes[string] = len(self.strings)
+            self.strings.append(string)
+        return code
+
+    def __getitem__(self, code):
+        return self.strings[code]
+
+
+_model_segments = None
+
+
+def model_segments(model):
+    """ Return the [start, end) MAC ranges of 'model' from the compiled MAC table, None without the table """
+    global _model_segments
+    if not load_mac_table():
+        return None
+    if _model_segments is None:
+        segments = {}
+        for start, end, phone in zip(macTableStarts, macTableStarts[1:] + [1 << 48], macTableModels):
+            if phone:
+                segments.setdefault(phone, []).append((start, end))
+        _model_segments = segments
+    return _model_segments.get(model, [])
+
+
+class PhoneTable(object):
+    """ Phones sorted by MAC in parallel arrays: the MAC as a 48 bit integer, the model as an index
+    of 'models' (+1, 0 when unknown), the company and the url as StringTable codes (0: redirection
+    not fetched) and the time of the last getPhoneRedirection (0: never) """
+
+    def __init__(self):
+        self.macs = array.array(MAC_TYPECODE)
+        self.model = array.array("B")
+        self.company = array.array("I")
+        self.target = array.array("I")
+        self.fetched = array.array("d")
+        self.models = [None] + models
+        self.model_codes = dict((model, code) for code, model in enumerate(self.models))
+        self.companies = StringTable()
+        self.urls = StringTable()
+
+    def __len__(self):
+        return len(self.macs)
+
+    def find(self, value):
+        """ Return the row of the MAC 'value', or -1 """
+        row = bisect.bisect_left(self.macs, value)
+        if row < len(self.macs) and self.macs[row] == value:
+            return row
+        return -1
+
+    def get(self, value):
+        """ Return the [model, company, target, fetched] of the MAC 'value', or None """
+        row = self.find(value)
+        if row < 0:
+            return None
+        return [self.models[self.model[row]], self.companies[self.company[row]],
+                self.urls[self.target[row]], self.fetched[row] or None]
+
+    def set(self, value, model, company=None, target=None, fetched=None):
+        """ Insert or replace the row of the MAC 'value' """
+        row = bisect.bisect_left(self.macs, value)
+        fields = (self.model_codes.get(model, 0), self.companies.code(company), self.urls.code(target),
+                  fetched or 0.0)
+        if row < len(self.macs) and self.macs[row] == value:
+            self.model[row], self.company[row], self.target[row], self.fetched[row] = fields
+            return
+        self.macs.insert(row, value)
+        for column, field in zip((self.model, self.company, self.target, self.fetched), fields):
+            column.insert(row, field)
+
+    def delete(self, value):
+        row = self.find(value)
+        if row < 0:
+            return False
+        for column in (self.macs, self.model, self.company, self.target, self.fetched):
+            column.pop(row)
+        return True
+
+    def rows(self, model=None):
+        """ Return the rows of 'model' (all rows if None) """
+        if model is None:
+            return range(len(self.macs))
+        segments = model_segments(model)
+        if segments is None:
+            code = self.model_codes.get(model, 0)
+            return [row for row, phone in enumerate(self.model) if phone == code]
+        rows = []
+        for start, end in segments:
+            first = bisect.bisect_left(self.macs, start)
+            rows.extend(range(first, bisect.bisect_left(self.macs, end, first)))
+        return rows
+
+    def replace_model(self, model, values):
+        """ Make the sorted MAC integers 'values' the rows of 'model', keeping the redirection of
+        the MACs that were already there """
+        code = self.model_codes.get(model, 0)
+        segments = model_segments(model)
+        if segments is None:
+            kept = set(values)
+            for row in reversed(self.rows(model)):
+                if self.macs[row] not in kept:
+                    self.delete(self.macs[row])
+            for value in values:
+                if self.find(value) < 0:
+                    self.set(value, model)
+            return
+        position = 0
+        for start, end in segments:
+            # the rows of a segment are contiguous: rebuild them as one slice of every column
+            first = bisect.bisect_left(self.macs, start)
+            last = bisect.bisect_left(self.macs, end, first)
+            position = bisect.bisect_left(values, start, position)
+            old = dict((self.macs[row], (self.company[row], self.target[row], self.fetched[row]))
+                       for row in range(first, last))
+            stop = bisect.bisect_left(values, end, position)
+            segment = values[position:stop]
+            position = stop
+            fields = [old.get(value, (0, 0, 0.0)) for value in segment]
+            self.macs[first:last] = array.array(MAC_TYPECODE, segment)
+            self.model[first:last] = array.array("B", [code] * len(segment))
+            self.company[first:last] = array.array("I", [field[0] for field in fields])
+            self.target[first:last] = array.array("I", [field[1] for field in fields])
+            self.fetched[first:last] = array.array("d", [field[2] for field in fields])
+
+
+class Inventory(object):
+    """ On-disk cache of the phones of one user of one redirection service endpoint """
+
+    def __init__(self, path, username, endpoint=None):
+        self.path = path
+        self.username = username
+        self.endpoint = endpoint or rpc_url
+        self.models = {}     # model -> time of the last complete listPhones
+        self.orders = {}     # model -> MAC integers in the order of that listPhones answer
+        self.table = PhoneTable()
+        self.dirty = False
+        self.generation = 0  # incremented by every change, see MacIndex
+        # pipelined batch commands update the cache from several threads
+        self._lock = threading.RLock()
+
+    def load(self):
+        try:
+            with open(self.path) as cachefile:
+                data = json.load(cachefile)
+        except (IOError, ValueError):
+            return
+        if data.get("username") != self.username or data.get("endpoint") != self.endpoint:
+            return
+        self.models = data.get("models", {})
+        self.orders = dict((model, array.array(MAC_TYPECODE, [int(mac, 16) for mac in macs]))
+                           for model, macs in data.get("orders", {}).items())
+        table = PhoneTable()
+        for mac, entry in sorted(data.get("phones", {}).items()):
+            table.macs.append(int(mac, 16))
+            table.model.append(table.model_codes.get(entry[0], 0))
+            table.company.append(table.companies.code(entry[1]))
+            table.target.append(table.urls.code(entry[2]))
+            table.fetched.append(entry[3] or 0.0)
+        self.table = table
+        self.generation += 1
+
+    def save(self):
+        with self._lock:
+            if not self.dirty:
+                return
+            table = self.table
+            phones = dict(("%012X" % table.macs[row],
+                           [table.models[table.model[row]], table.companies[table.company[row]],
+                            table.urls[table.target[row]], table.fetched[row] or None])
+                          for row in range(len(table)))
+            tmp = "%s.tmp" % self.path
+            with open(tmp, "w") as cachefile:
+                orders = dict((model, ["%012X" % value for value in values]) for model, values in self.orders.items())
+                json.dump({"username": self.username, "endpoint": self.endpoint, "models": self.models,
+                           "orders": orders, "phones": phones}, cachefile)
+            os.rename(tmp, self.path)
+            self.dirty = False
+
+    def is_fresh(self, fetched):
+        mode = get_cache_mode()
+        if fetched is None or mode == "fresh":
+            return False
+        if mode == "cached":
+            return True
+        return time.time() - fetched < get_cache_ttl()
+
+    def listing(self, model):
+        """ Return the cached MACs of 'model', or None if the listing is missing or stale """
+        if not self.is_fresh(self.models.get(model)):
+            return None
+        with self._lock:
+            macs = self.table.macs
+            values = [macs[row] for row in self.table.rows(model)]
+            # the order of the server answer, then the phones added since in MAC order
+            remaining = set(values)
+            listed = []
+            for value in self.orders.get(model, ()):
+                if value in remaining:
+                    remaining.discard(value)
+                    listed.append(value)
+            listed.extend(value for value in values if value in remaining)
+            return ["%012X" % value for value in listed]
+
+    def redirection(self, mac):
+        """ Return the cached getPhoneRedirection result of 'mac', or None if it is missing or stale """
+        try:
+            value = int(mac, 16)
+        except ValueError:
+            return None
+        with self._lock:
+            entry = self.table.get(value)
+        if entry is None or entry[1] is None or not self.is_fresh(entry[3]):
+            return None
+        return [True, entry[1], entry[2]]
+
+    def store_listing(self, model, macs):
+        values = [int(mac, 16) for mac in macs]
+        with self._lock:
+            self.table.replace_model(model, sorted(set(values)))
+            self.orders[model] = array.array(MAC_TYPECODE, values)
+            self.models[model] = time.time()
+            self.dirty = True
+            self.generation += 1
+
+    def store_redirection(self, mac, redirection):
+        with self._lock:
+            self.table.set(int(mac, 16), classify_mac(mac), redirection[1] or '', redirection[2] or '', time.time())
+            self.dirty = True
+            self.generation += 1
+
+    def add(self, mac):
+        """ A phone has been registered: add it to its model listing, its redirection is unknown """
+        with self._lock:
+            self.table.set(int(mac, 16), classify_mac(mac))
+            self.dirty = True
+            self.generation += 1
+
+    def invalidate(self, mac):
+        """ The redirection of a phone changed: forget the cached target """
+        with self._lock:
+            row = self.table.find(int(mac, 16))
+            if row >= 0:
+                self.table.company[row] = self.table.target[row] = 0
+                self.table.fetched[row] = 0.0
+                self.dirty = True
+                self.generation += 1
+
+    def forget(self, mac):
+        """ The state of a phone is unknown: drop it and mark its model listing as stale """
+        with self._lock:
+            self.remove(mac)
+            self.models.pop(classify_mac(mac), None)
+            self.dirty = True
+            self.generation += 1
+
+    def remove(self, mac):
+        with self._lock:
+            if self.table.delete(int(mac, 16)):
+                self.dirty = True
+                self.generation += 1
+
+    def stale_models(self, model_list):
+        return [model for model in model_list if not self.is_fresh(self.models.get(model))]
+
+    def stale_macs(self, model_list=None):
+        table = self.table
+        with self._lock:
+            if model_list is None:
+                rows = table.rows()
+            else:
+                rows = sorted(itertools.chain.from_iterable(table.rows(model) for model in model_list))
+            return ["%012X" % table.macs[row] for row in rows
+                    if not table.company[row] or not self.is_fresh(table.fetched[row] or None)]
+
+    def known_models(self):
+        table = self.table
+        present = set(table.model)
+        return [model for model in models if table.model_codes[model] in present]
+
+
+# Inventory snapshots
+#
+# 'snapshot save' writes the inventory as a binary file whose columns can be
+# memory-mapped for offline analysis (Eg. with numpy.memmap). Little-endian:
+#   0    8s         magic "SNOMINV1"
+#   8    Q          count: number of phones
+#   16   Q          length of the JSON metadata ending the file
+#   24   Q          reserved
+#   32   count x Q  MACs, sorted
+#        count x d  time of the last getPhoneRedirection (0: never)
+#        count x I  company codes (0: redirection not fetched)
+#        count x I  url codes (0: redirection not fetched)
+#        count x B  model codes (0: unknown), zero padded to a multiple of 8 bytes
+#        JSON       {"username", "created", "listings", "models", "companies", "urls"},
+#                   the code of a string is its index in its list
+
+SNAPSHOT_MAGIC = b"SNOMINV1"
+SNAPSHOT_HEADER = struct.Struct("<8sQQQ")
+SNAPSHOT_COLUMNS = (("macs", MAC_TYPECODE), ("fetched", "d"), ("company", "I"), ("target", "I"), ("model", "B"))
+
+
+def save_snapshot(path, table, username, listings):
+    """ Write the PhoneTable 'table' to the snapshot file 'path' """
+    meta = json.dumps({"username": username, "created": time.time(), "listings": listings,
+                       "models": table.models, "companies": table.companies.strings,
+                       "urls": table.urls.strings}).encode("utf-8")
+    tmp = "%s.tmp" % path
+    with open(tmp, "wb") as snapshot:
+        snapshot.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, len(table), len(meta), 0))
+        size = 0
+        for name, typecode in SNAPSHOT_COLUMNS:
+            column = getattr(table, name)
+            if sys.byteorder != "little":
+                column = array.array(typecode, column)
+                column.byteswap()
+            data = column.tobytes() if hasattr(column, "tobytes") else column.tostring()
+            snapshot.write(data)
+            size += len(data)
+        snapshot.write(b"\0" * (-size % 8))
+        snapshot.write(meta)
+    os.rename(tmp, path)
+
+
+class Snapshot(object):
+    """ Read-only view of a snapshot file, with the columns and string tables of a PhoneTable.
+    On little-endian Python 3 the columns are memoryviews of the memory-mapped file. """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, mmap.error):
+            self._file.close()
+            raise ValueError("%s is not a snapshot file" % path)
+        magic, count, meta_length, _ = SNAPSHOT_HEADER.unpack(self._map[:SNAPSHOT_HEADER.size])
+        if magic != SNAPSHOT_MAGIC:
+            self.close()
+            raise ValueError("%s is not a snapshot file" % path)
+        self.count = count
+        offset = SNAPSHOT_HEADER.size
+        view = memoryview(self._map) if hasattr(memoryview, "cast") and sys.byteorder == "little" else None
+        for name, typecode in SNAPSHOT_COLUMNS:
+            size = count * array.array(typecode).itemsize
+            if view is not None:
+                column = view[offset:offset + size].cast(typecode)
+            else:
+                column = array.array(typecode)
+                (getattr(column, "frombytes", None) or column.fromstring)(self._map[offset:offset + size])
+                if sys.byteorder != "little":
+                    column.byteswap()
+            setattr(self, name, column)
+            offset += size
+        offset += -offset % 8
+        meta = json.loads(self._map[offset:offset + meta_length].decode("utf-8"))
+        self.username = meta["username"]
+        self.created = meta["created"]
+        self.listings = meta["listings"]
+        self.models = meta["models"]
+        self.companies = meta["companies"]
+        self.urls = meta["urls"]
+
+    def __len__(self):
+        return self.count
+
+    def to_table(self):
+        """ Copy the snapshot into a PhoneTable """
+        table = PhoneTable()
+        for name, typecode in SNAPSHOT_COLUMNS:
+            column = getattr(self, name)
+            if isinstance(column, memoryview):
+                copy = array.array(typecode)
+                copy.frombytes(column.cast("B"))
+            else:
+                copy = array.array(typecode, column)
+            setattr(table, name, copy)
+        table.companies = StringTable(self.companies[1:])
+        table.urls = StringTable(self.urls[1:])
+        # the model codes of the snapshot may come from another release
+        remap = [table.model_codes.get(model, 0) for model in self.models]
+        table.model = array.array("B", [remap[code] for code in table.model])
+        return table
+
+    def close(self):
+        for name, typecode in SNAPSHOT_COLUMNS:
+            column = getattr(self, name, None)
+            if hasattr(column, "release"):
+                column.release()
+        self._map.close()
+        self._file.close()
+
+
+def group_counts(table, keys):
+    """ Count the phones of 'table' (a PhoneTable or a Snapshot) per combination of the 'keys'
+    "model", "company" and "url". Returns [(values, count)] sorted by decreasing count. """
+    columns = {"model": table.model, "company": table.company, "url": table.target}
+    names = {"model": table.models, "company": table.companies, "url": table.urls}
+    counts = {}
+    for codes in zip(*[columns[key] for key in keys]):
+        counts[codes] = counts.get(codes, 0) + 1
+    decoded = [(tuple(names[key][code] for key, code in zip(keys, codes)), count)
+               for codes, count in counts.items()]
+    return sorted(decoded, key=lambda entry: (-entry[1], [value or "" for value in entry[0]]))
+
+
+inventory = None
+_inventory_lock = threading.Lock()
+
+
+def get_inventory():
+    """ Return the inventory cache of the current user or account, loading it on first use """
+    global inventory
+    account = current_account()
+    if account is not None:
+        return account.get_inventory()
+    if inventory is None:
+        with _inventory_lock:
+            if inventory is None:
+                homedir = os.path.expanduser('~')
+                cache = Inventory("%s/.snomcli_inventory" % homedir, defaults["username"], rpc_url)
+                cache.load()
+                inventory = cache
+    return inventory
+
+
+class MacIndex(object):
+    """ Sorted MACs of the inventory cache, answering prefix queries with two bisections """
+
+    def __init__(self):
+        self.macs = []
+        self.source = None
+
+    def update(self, inv):
+        """ Rebuild the index if the inventory 'inv' changed since the last build """
+        if self.source != (id(inv), inv.generation):
+            with inv._lock:
+                self.macs = ["%012X" % value for value in inv.table.macs]
+                self.source = (id(inv), inv.generation)
+        return self
+
+    def range(self, prefix):
+        first = bisect.bisect_left(self.macs, prefix)
+        return first, bisect.bisect_left(self.macs, prefix + "G", first)
+
+    def complete(self, prefix, limit=256):
+        """ Return the indexed MACs starting with 'prefix'. Beyond 'limit' matches, return
+        the longer prefixes (one more digit) they share instead, to keep completion instant. """
+        prefix = prefix.upper()
+        first, last = self.range(prefix)
+        while last - first > limit and len(prefix) < 12:
+            longer = []
+            for digit in HEX_DIGITS:
+                start, end = self.range(prefix + digit)
+                if start != end:
+                    longer.append(prefix + digit)
+            if len(longer) > 1:
+                return longer
+            prefix = longer[0]
+        return self.macs[first:last]
+
+
+mac_index = MacIndex()
+
+
+def complete_macs(prefix):
+    """ Known MACs starting with 'prefix', from the inventory cache only: completion never calls the server """
+    matches = mac_index.update(get_inventory()).complete(prefix)
+    if matches:
+        return matches
+    return [oui for oui in ("000413", "00087B") if oui.startswith(prefix.upper())]
+
+
+def iter_redirections(macs):
+    """ Yield (mac, getPhoneRedirection result) for every MAC of the iterable 'macs', in order,
+    as soon as the lookups complete: fresh results come from the inventory cache, the others
+    are fetched in multicall batches running concurrently. """
+    inv = get_inventory()
+
+    def lookup():
+        for mac in macs:
+            yield mac, inv.redirection(mac)
+
+    def fetch(batch):
+        missing = [mac for mac, redirection in batch if redirection is None]
+        fetched = multicall("redirect.getPhoneRedirection", [(mac,) for mac in missing])
+        fetched = iter(fetched)
+        return [(mac, redirection, False) if redirection is not None else (mac, next(fetched), True)
+                for mac, redirection in batch]
+
+    for batch, result, err in run_ordered(fetch, chunks(lookup(), get_batch_size())):
+        if err is not None:
+            result = [(mac, None, False) for mac, redirection in batch]
+        for mac, redirection, fetched in result:
+            if fetched and redirection and redirection[0] == True:
+                inv.store_redirection(mac, redirection)
+            yield mac, redirection
+
+
+def get_redirections(macs):
+    """ Return the getPhoneRedirection results of 'macs', see iter_redirections() """
+    return [redirection for mac, redirection in iter_redirections(macs)]
+
+
+# Job journal
+#
+# Long running bulk jobs append the intent and the outcome of every MAC they
+# touch to a journal in ~/.snomcli_jobs, so an interrupted job can be resumed
+# without redoing (or losing) the phones it already handled.
+
+class Journal(object):
+    """ Append-only JSON lines record of a bulk job """
+
+    def __init__(self, path):
+        self.path = path
+        self.job = os.path.basename(path)[:-len(".log")]
+        self.command = None
+        self.args = []
+        self.started = None
+        self.finished = False
+        self.intents = {}    # mac -> [operation, url]
+        self.outcomes = {}   # mac -> error code, None if successful
+        self.retry = set()   # MACs whose outcome is a failure to get an answer
+        self.updated = None  # time of the last entry
+        self._file = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def create(cls, command, args):
+        directory = jobs_dir()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        started = time.time()
+        path = os.path.join(directory, "%s-%s.log" % (command, time.strftime("%Y%m%d-%H%M%S", time.localtime(started))))
+        n = 1
+        while os.path.exists(path):
+            n += 1
+            path = os.path.join(directory, "%s-%s-%d.log" % (command, time.strftime("%Y%m%d-%H%M%S", time.localtime(started)), n))
+        journal = cls(path)
+        journal.command, journal.args, journal.started = command, list(args), started
+        journal._write({"job": journal.job, "command": command, "args": journal.args, "started": started})
+        return journal
+
+    def load(self):
+        with open(self.path) as logfile:
+            for line in logfile:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # a line cut short by an interruption
+                    continue
+                self.updated = entry.get("time", entry.get("started", entry.get("finished", self.updated)))
+                if "command" in entry:
+                    self.command, self.args, self.started = entry["command"], entry["args"], entry["started"]
+                elif "finished" in entry:
+                    self.finished = True
+                elif "op" in entry:
+                    self.intents[entry["mac"]] = [entry["op"], entry.get("url")]
+                elif "mac" in entry:
+                    self.outcomes[entry["mac"]] = entry.get("error")
+                    if entry.get("retry"):
+                        self.retry.add(entry["mac"])
+                    else:
+                        self.retry.discard(entry["mac"])
+        return self
+
+    def _write(self, entry):
+        line = json.dumps(entry) + "\n"
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, "a")
+            self._file.write(line)
+            self._file.flush()
+
+    def intent(self, mac, operation, url=None):
+        self.intents[mac] = [operation, url]
+        self._write({"mac": mac, "op": operation, "url": url, "time": time.time()})
+
+    def outcome(self, mac, error=None, retry=False):
+        """ Record the result of 'mac': 'retry' if the request got no answer and can be sent again """
+        self.outcomes[mac] = error
+        entry = {"mac": mac, "error": error, "time": time.time()}
+        if retry:
+            self.retry.add(mac)
+            entry["retry"] = True
+        else:
+            self.retry.discard(mac)
+        self._write(entry)
+
+    def pending(self):
+        """ Return the (mac, operation, url) of the intents without a successful outcome """
+        return [(mac, intent[0], intent[1]) for mac, intent in sorted(self.intents.items())
+                if mac not in self.outcomes or self.outcomes[mac] is not None]
+
+    def completed(self):
+        """ Return the set of MACs with a final outcome: a success or any answer of the server.
+        Transport failures and interrupted intents are not final. """
+        return set(self.outcomes) - self.retry
+
+    def unfinished(self):
+        """ Return the set of MACs still to be retried: without a final outcome """
+        return (set(self.intents) | set(self.outcomes)) - self.completed()
+
+    def in_doubt(self):
+        """ Return the set of MACs whose request was sent but whose outcome is unknown: never
+        recorded, or a failure to get an answer after the server may have applied it """
+        return set(mac for mac in self.intents if mac not in self.outcomes or mac in self.retry)
+
+    def rate(self):
+        """ Outcomes recorded per second of the run """
+        elapsed = (self.updated or 0) - (self.started or 0)
+        return len(self.outcomes) / elapsed if elapsed > 0 else 0.0
+
+    def finish(self):
+        self.finished = True
+        self._write({"finished": time.time()})
+        self.close()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def is_final(err):
+    """ True for the outcome of a request that failed with the exception 'err' (None if the
+    server answered) if sending it again would get the same answer: any answer of the server,
+    even an unexpected one or a fault, is final. """
+    return err is None or isinstance(err, Fault)
+
+
+def jobs_dir():
+    return "%s/.snomcli_jobs" % os.path.expanduser('~')
+
+
+def load_jobs():
+    """ Return the journals of all jobs, oldest first """
+    directory = jobs_dir()
+    if not os.path.isdir(directory):
+        return []
+    return [Journal(os.path.join(directory, name)).load()
+            for name in sorted(os.listdir(directory)) if name.endswith(".log")]
+
+
+def job_names():
+    """ Return the names of the recorded jobs, without reading their journals """
+    directory = jobs_dir()
+    if not os.path.isdir(directory):
+        return []
+    return [name[:-len(".log")] for name in sorted(os.listdir(directory)) if name.endswith(".log")]
+
+
+def find_unfinished_job(command, args):
+    """ Return the latest unfinished journal of 'command' run with 'args', or None """
+    for journal in reversed(load_jobs()):
+        if journal.command == command and journal.args == list(args) and not journal.finished:
+            return journal
+    return None
+
+
+def find_job(job):
+    """ Return the journal of 'job', or None """
+    path = os.path.join(jobs_dir(), "%s.log" % os.path.basename(job))
+    if not os.path.isfile(path):
+        return None
+    return Journal(path).load()
+
+
+# Interactive console
+
+def setup_readline():
+    """ Configure tab completion; only the interactive console needs readline """
+    try:
+        import rlcompleter
+        import readline
+        if 'libedit' in readline.__doc__:
+            readline.parse_and_bind("bind ^I rl_complete")
+        else:
+            readline.parse_and_bind("tab: complete")
+        # complete whole words: MACs with ':', urls, '--options' and '%variables'
+        readline.set_completer_delims(" \t\n")
+    except ImportError:
+        # no readline support
+        pass
+
+
+# Credential cache
+#
+# Opt-in: with 'defaults credttl <seconds>' set above 0, a password typed at
+# the prompt and verified by validate_password() is kept in plain text in
+# ~/.snomcli_session (readable by the user only) for that many seconds, so
+# consecutive one-shot invocations neither prompt nor re-verify it. With the
+# default of 0 the password is never written and a left-over cache is ignored.
+
+def credentials_path():
+    return "%s/.snomcli_session" % os.path.expanduser('~')
+
+
+def get_credential_ttl():
+    try:
+        return float(defaults["credttl"])
+    except ValueError:
+        return 0.0
+
+
+def load_credentials(user):
+    """ Return the cached password of 'user', or None if there is none, it expired or caching is off """
+    if get_credential_ttl() <= 0:
+        return None
+    try:
+        with open(credentials_path()) as session:
+            data = json.load(session)
+    except (IOError, ValueError):
+        return None
+    if data.get("username") != user or time.time() > data.get("expires", 0):
+        return None
+    return data.get("password")
+
+
+def store_credentials(user, passwd):
+    ttl = get_credential_ttl()
+    if ttl <= 0:
+        return
+    try:
+        fd = os.open(credentials_path(), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as session:
+            json.dump({"username": user, "password": passwd, "expires": time.time() + ttl}, session)
+    except (IOError, OSError):
+        pass
+
+
+# Accounts
+#
+# Resellers manage several redirection accounts. Their credentials are kept in
+# ~/.snomcli_accounts as 'name|username|password' lines, and 'accounts' runs a
+# command for several of them in parallel. The account a thread works for is
+# thread-local: get_server() and get_inventory() then return the connection and
+# the inventory cache (~/.snomcli_inventory_<name>) of that account, and the
+# worker threads of run_parallel() and run_async() inherit it.
+
+_account = threading.local()
+
+
+def current_account():
+    return getattr(_account, "value", None)
+
+
+def set_account(account):
+    """ Make the current thread work for 'account', or for the session user if None """
+    _account.value = account
+
+
+class Account(object):
+    """ Credentials, RPC connection and inventory cache of one profile """
+
+    def __init__(self, name, username, password=""):
+        self.name = name
+        self.username = username
+        self.password = password
+        self.server = None
+        self.inventory = None
+        self._lock = threading.Lock()
+
+    def get_server(self):
+        if self.server is None:
+            with self._lock:
+                if self.server is None:
+                    self.server = make_rpc_conn(self.username, self.password)
+        return self.server
+
+    def get_inventory(self):
+        if self.inventory is None:
+            with self._lock:
+                if self.inventory is None:
+                    homedir = os.path.expanduser('~')
+                    cache = Inventory("%s/.snomcli_inventory_%s" % (homedir, self.name), self.username, rpc_url)
+                    cache.load()
+                    self.inventory = cache
+        return self.inventory
+
+
+def accounts_path():
+    return "%s/.snomcli_accounts" % os.path.expanduser('~')
+
+
+def load_accounts():
+    """ Return the profiles of ~/.snomcli_accounts in file order. Every line is
+    'name|username[|password]', blank lines and comments are skipped. """
+    accounts = []
+    try:
+        with open(accounts_path()) as profiles:
+            for line in profiles:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                fields = line.split("|", 2)
+                if len(fields) < 2:
+                    continue
+                accounts.append(Account(fields[0].strip(), fields[1].strip(),
+                                        fields[2].strip() if len(fields) > 2 else ""))
+    except IOError:
+        pass
+    return accounts
+
+
+def select_accounts(names):
+    """ Return the accounts named in the comma separated 'names' ("all" for every profile),
+    and the names that are not in the profile file """
+    accounts = load_accounts()
+    if names == "all":
+        return accounts, []
+    by_name = dict((account.name, account) for account in accounts)
+    wanted = [name for name in names.split(",") if name]
+    return [by_name[name] for name in wanted if name in by_name], [name for name in wanted if name not in by_name]
+
+
+def tag_account(line, name, width):
+    """ Prefix an output line with the account column, or add an "account" key to a JSON object line """
+    if line.startswith("{"):
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        if isinstance(record, dict):
+            return json.dumps(dict([("account", name)] + list(record.items())))
+    return "%s  %s" % (name.ljust(width), line)
+
+
+# Commands
+
+def validate_password(user, passwd):
+    s = make_rpc_conn(user, passwd)
+
+    try:
+        s.network.echo("ping")
+    except Error as err:
+        print_failure("Error: %d %s" % (err.errcode, err.errmsg))
+        return False
+
+    return True
+
+
+# Replace variable values
+def replace_value(var):
+    if var.startswith('%'):
+        varname = var[1:]
+        if varname in local_vars:
+            return local_vars[varname]
+        else:
+            return var
+    else:
+        return var
+
+
+class CurrentStdout(object):
+    """ Stream writing to sys.stdout as it is at the time of the write, so that the help and the
+    errors of cmd.Cmd go to the buffer of the running batch command (see ThreadOutput) """
+
+    def write(self, data):
+        sys.stdout.write(data)
+
+    def flush(self):
+        sys.stdout.flush()
+
+
+class RedirectionCli(cmd.Cmd):
+    """Command processor"""
+
+    def __init__(self):
+        cmd.Cmd.__init__(self, stdout=CurrentStdout())
+        self._history = []
+        self.prompt = "%s%%> " % username
+        self.intro = banner  # defaults to None
+        self.doc_header = "Available commands (type help <command>):"
+
+    def _get_redirection_target(self, mac):
+        return self._format_redirection(mac, get_server().redirect.getPhoneRedirection(mac))
+
+    def _format_redirection(self, mac, redirection):
+        if redirection and redirection[0] == True:
+            company = redirection[1] or ''
+            target = redirection[2] or ''
+            return " %s | %s " % (company.ljust(32), target.ljust(80))
+        else:
+            print("Error in getting phone redirection (%s)" % mac)
+            return ''
+
+    def _print_result(self, result, fmt="table"):
+        """ Print the phones of the iterable 'result' with their redirection, one row as soon as it is known """
+        if fmt == "table":
+            print("-" * 136)
+            print("| MAC  address |              Company              | URL%s|" % (" " * 79))
+            print("-" * 136)
+        elif fmt == "csv":
+            writer = csv.writer(sys.stdout)
+            writer.writerow(["mac", "model", "company", "url"])
+        for x, redirection in iter_redirections(result):
+            if fmt == "table":
+                target = self._format_redirection(x, redirection)
+                print("\n".join(["| %s | %s |" % (x.upper().ljust(10), target)]))
+            elif redirection and redirection[0] == True:
+                if fmt == "csv":
+                    writer.writerow([x.upper(), classify_mac(x), redirection[1] or '', redirection[2] or ''])
+                else:
+                    print(json.dumps({"mac": x.upper(), "model": classify_mac(x),
+                                      "company": redirection[1] or '', "url": redirection[2] or ''}))
+            else:
+                error = redirection[1] if redirection else "Error"
+                if fmt == "csv":
+                    writer.writerow([x.upper(), classify_mac(x), '', ''])
+                    sys.stderr.write("Error in getting phone redirection (%s)\n" % x)
+                else:
+                    print(json.dumps({"mac": x.upper(), "model": classify_mac(x), "error": error}))
+        if fmt == "table":
+            print("-" * 136)
+        return
+
+    def _list_all(self, model_list=None, fmt="table"):
+        if fmt == "table":
+            print("Loading information ...\n")
+        errors = {}
+        result = iter_phones(model_list or models, errors=errors)
+        first = next(result, None)
+        if first is not None:
+            self._print_result(itertools.chain([first], result), fmt)
+        elif not errors and fmt == "table":
+            print("No phones registered for this user.")
+        for model in errors:
+            message = "Error listing %s phones: %s" % (model, error_message(errors[model]))
+            if fmt == "table":
+                print_failure(message)
+            else:
+                # keep the machine-readable output clean
+                sys.stderr.write(message + "\n")
+                mark_failed()
+
+    def do_list(self, params):
+        """List phones configured in redirection service
+            'list all' list all phones
+            'list all --inventory [<file>]' list all phones, querying only the models present in the local inventory <file> of 'mac[,url]' rows
+                                            or, without <file>, in the inventory cache
+            'list <phone_type>' list only phone matching <phone_type> (Eg. "list snom370")
+            'list <phone_type> <url>' list only phone matching thist <phone_type> and <url> (Eg. "list snom370 http://server.example.com/" )
+            '--format table|jsonl|csv' print the phones as a table (default), JSON lines or CSV (Eg. "list all --format jsonl")
+                                       with jsonl and csv, error messages go to stderr
+        """
+        args = params.split()
+        fmt = "table"
+        if "--format" in args:
+            index = args.index("--format")
+            if index + 1 >= len(args) or args[index + 1] not in ("table", "jsonl", "csv"):
+                print_failure("Wrong arguments. Use '--format table|jsonl|csv'")
+                return
+            fmt = args[index + 1]
+            del args[index:index + 2]
+        if len(args) >= 1:
+            # list all
+            if args[0] == "all":
+                if len(args) == 3 and args[1] == "--inventory":
+                    if not os.path.isfile(args[2]):
+                        print_failure("Error: file %s not found" % args[2])
+                        return
+                    model_list = inventory_models(args[2])
+                    if not model_list:
+                        print("No known phone models in %s." % args[2])
+                        return
+                    return self._list_all(model_list, fmt)
+                if len(args) == 2 and args[1] == "--inventory":
+                    model_list = get_inventory().known_models()
+                    if not model_list:
+                        print("No phones in the inventory cache, use 'refresh' or 'list all' first.")
+                        return
+                    return self._list_all(model_list, fmt)
+                return self._list_all(fmt=fmt)
+            model = args[0]
+            if model not in models:
+                print_failure("Error: model %s not found" % model)
+                return
+            if len(args) == 2:
+                url = args[1]
+            else:
+                url = None
+            errors = {}
+            result = iter_phones([model], url, errors)
+            first = next(result, None)
+            if model in errors:
+                print_failure("Error: %s" % errors[model])
+                return
+            if first is not None:
+                self._print_result(itertools.chain([first], result), fmt)
+                if model in errors:
+                    if fmt == "table":
+                        print_failure("Error: %s" % errors[model])
+                    else:
+                        sys.stderr.write("Error: %s\n" % errors[model])
+                        mark_failed()
+                return
+            elif fmt != "table":
+                return
+            else:
+                if len(args) == 2:
+                    print("No phones of type %s redirected to %s registered for this user." % (model, url))
+                else:
+                    print("No phones of type %s registered for this user." % model)
+                return
+        else:
+            print_failure("Wrong arguments. Use 'list phonetype [url]' or 'list all'")
+            return
+
+    # add command
+    def do_add(self, params):
+        """Add phone in redirection service
+            'add <mac> <url>' add redirection to <url> for mac address <mac> (Eg. "add 000413XXXXXX http://server.example.com")
+            in case the <url> param is missing the default url value will be used (see the 'defaults' command)
+        """
+        args = list(map(replace_value, params.split()))
+        if len(args) == 1:
+            if len(defaults['url']) > 0:
+                args.append(defaults['url'])
+            else:
+                print_failure("ERROR: Default url not defined, please define it using 'default url <url>'")
+                return
+        if len(args) != 2:
+            print_failure("Wrong arguments. Use 'add mac_address target_url'")
+            return
+        if not validate_mac(args[0]):
+            print_failure("%s does not seem to be a valid snom MAC address." % args[0])
+            return
+        print("Adding redirection for %s to %s." % (args[0], args[1]))
+        result = get_server().redirect.checkPhone(args[0])
+        if result[0]:
+            print_failure("Phone already registered, use 'remove' or 'update' command")
+            return
+        result = get_server().redirect.registerPhone(args[0], args[1])
+        if result[0]:
+            get_inventory().add(args[0])
+            print("Redirection to %s for %s with MAC address %s has been successfully registered." % (args[1], get_type(args[0]), args[0]))
+        else:
+            print_error(result)
+            return
+
+    # import command
+    def do_import(self, params):
+        """Bulk add phones from a CSV file to the redirection service
+            'import <file.csv>' register every 'mac,url' row of <file.csv> (Eg. "import phones.csv")
+            'import <file.csv> --update' also re-register the rows of phones that are already registered
+            rows without an url use the default url (see the 'defaults' command)
+            the number of concurrent requests is set with 'defaults workers <n>', 'defaults backend asyncio'
+            runs them on an asyncio event loop instead of worker threads
+            an interrupted import is continued with 'resume <job>' (see 'jobs')
+        """
+        args = params.split()
+        if len(args) not in (1, 2) or (len(args) == 2 and args[1] != "--update"):
+            print_failure("Wrong arguments. Use 'import file.csv [--update]'")
+            return
+        if not os.path.isfile(args[0]):
+            print_failure("Error: file %s not found" % args[0])
+            return
+        args[0] = os.path.abspath(args[0])
+        journal = find_unfinished_job("import", args)
+        if journal is not None:
+            print("Note: job %s imported this file before and was not completed, 'resume %s' continues it." % (
+                journal.job, journal.job))
+        self._import(Journal.create("import", args))
+
+    def _import(self, journal, resumed=False):
+        """ Run the import job of 'journal', skipping the rows it already completed """
+        path, update = journal.args[0], "--update" in journal.args
+        done = journal.completed()
+        doubt = journal.in_doubt()
+        operation = "update" if update else "add"
+
+        def prepare(row):
+            mac, url = row
+            url = replace_value(url) or defaults["url"]
+            if not validate_mac(mac, verbose=False):
+                return None, (False, "Error:malformed_mac")
+            if not url:
+                return None, (False, "Error:no_url")
+            journal.intent(mac, operation, url)
+            if update:
+                return "update_phone", (mac, url)
+            if mac in doubt:
+                return "ensure_phone", (mac, url)
+            return "register_new_phone", (mac, url)
+
+        def register(row):
+            method, args = prepare(row)
+            if method is None:
+                return args
+            conn = get_server()
+            if method == "update_phone":
+                conn.redirect.deregisterPhone(args[0])
+                return conn.redirect.registerPhone(*args)
+            if method == "ensure_phone":
+                # the interrupted run may have registered it already
+                result = conn.redirect.getPhoneRedirection(args[0])
+                if result[0] and result[2] == args[1]:
+                    return [True]
+            result = conn.redirect.checkPhone(args[0])
+            if result[0]:
+                return (False, "Error:already_registered")
+            return conn.redirect.registerPhone(*args)
+
+        skipped = [0]
+
+        def rows():
+            for row in read_mac_csv(path):
+                if row[0] in done:
+                    skipped[0] += 1
+                    continue
+                yield row
+
+        if get_backend() == "asyncio":
+            results = run_async(prepare, rows())
+        else:
+            results = run_parallel(register, rows())
+        progress = Progress("Imported")
+        errors = {}
+        registered = 0
+        retry = 0
+        inv = get_inventory()
+        try:
+            for (mac, url), result, err in results:
+                progress.update()
+                if err is None and result[0]:
+                    journal.outcome(mac)
+                    inv.add(mac)
+                    registered += 1
+                    continue
+                code = error_code(result, err)
+                journal.outcome(mac, code, not is_final(err))
+                if not is_final(err):
+                    retry += 1
+                if update:
+                    inv.forget(mac)
+                errors[code] = errors.get(code, 0) + 1
+                progress.message("%s: %s" % (mac, error_message(code)))
+        except KeyboardInterrupt:
+            journal.close()
+            print("\nInterrupted: 'resume %s' continues the import." % journal.job)
+            raise
+        progress.finish()
+        if resumed:
+            print("%d rows already done were skipped." % skipped[0])
+        print("%d phones %s, %d failed." % (registered, "updated" if update else "registered",
+                                           progress.count - registered))
+        print_error_summary(errors)
+        if retry:
+            journal.close()
+            print("%d phones failed to reach the server, 'resume %s' retries them." % (retry, journal.job))
+        else:
+            journal.finish()
+
+    # resume command
+    def do_resume(self, params):
+        """Continue an interrupted bulk job
+            'resume <job>' continue the job <job> listed by 'jobs', skipping the phones it already completed
+        """
+        args = params.split()
+        if len(args) != 1:
+            print_failure("Wrong arguments. Use 'resume job'")
+            return
+        journal = find_job(args[0])
+        if journal is None or journal.command is None:
+            print_failure("Error: job %s not found" % args[0])
+            return
+        if journal.finished:
+            print_failure("Error: job %s is already completed" % journal.job)
+            return
+        print("Resuming job %s: %d phones done, %d to retry." % (
+            journal.job, len(journal.completed()), len(journal.unfinished())))
+        if journal.command == "import":
+            if not os.path.isfile(journal.args[0]):
+                print_failure("Error: file %s not found" % journal.args[0])
+                return
+            self._import(journal, resumed=True)
+        elif journal.command == "migrate":
+            # the arguments are journaled with their %variables already substituted
+            self._migrate(journal, journal.args[0], journal.args[1], journal.args[2:] or models)
+        else:
+            print_failure("Error: jobs of the %s command cannot be resumed" % journal.command)
+
+    # jobs command
+    def do_jobs(self, params):
+        """List the bulk jobs recorded in ~/.snomcli_jobs
+            'jobs' list the jobs that did not complete, with their progress and throughput
+            'jobs all' list all jobs
+            'jobs clean' delete the journals of the completed jobs
+        """
+        args = params.split()
+        if args not in ([], ["all"], ["clean"]):
+            print_failure("Wrong arguments. Use 'jobs', 'jobs all' or 'jobs clean'")
+            return
+        journals = load_jobs()
+        if args == ["clean"]:
+            finished = [journal for journal in journals if journal.finished]
+            for journal in finished:
+                os.remove(journal.path)
+            print("%d completed jobs removed." % len(finished))
+            return
+        if args != ["all"]:
+            journals = [journal for journal in journals if not journal.finished]
+        if not journals:
+            print("No %sjobs." % ("" if args else "unfinished "))
+            return
+        print("%-28s %-8s %-8s %8s %8s %8s %8s  %s" % ("job", "command", "status", "done", "failed", "retry", "rate/s", "started"))
+        for journal in journals:
+            completed = journal.completed()
+            failed = len([mac for mac in completed if journal.outcomes[mac] is not None])
+            print("%-28s %-8s %-8s %8d %8d %8d %8.1f  %s" % (
+                journal.job, journal.command, "done" if journal.finished else "partial",
+                len(completed) - failed, failed, len(journal.unfinished()), journal.rate(),
+                time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(journal.started or 0))))
+            print("    %s %s" % (journal.command, " ".join(journal.args)))
+
+    # accounts command
+    def do_accounts(self, params):
+        """Run a command for several redirection accounts in parallel
+            'accounts' list the profiles of ~/.snomcli_accounts, one 'name|username|password' line per account
+                       (without a password, it is prompted for)
+            'accounts <name>,<name>...|all <command>' run <command> for the given accounts in parallel, each with
+                       its own connection and inventory cache (Eg. "accounts all check @tickets.txt")
+            the output lines are merged with an account column, followed by the time and status of each account
+        """
+        args = params.split(None, 1)
+        if not args:
+            accounts = load_accounts()
+            if not accounts:
+                print("No accounts in %s." % accounts_path())
+                return
+            width = max([len("account")] + [len(account.name) for account in accounts])
+            print("%s  %s" % ("account".ljust(width), "username"))
+            for account in accounts:
+                print("%s  %s" % (account.name.ljust(width), account.username))
+            return
+        if len(args) < 2 or args[1].split()[0] in ("accounts", "set", "print", "defaults", "history", "help",
+                                                   "version", "resume", "jobs", "exit", "EOF"):
+            print_failure("Wrong arguments. Use 'accounts' or 'accounts name,...|all command'")
+            return
+        command = args[1]
+        accounts, unknown = select_accounts(args[0])
+        if unknown:
+            print_failure("Error: no account %s in %s" % (",".join(unknown), accounts_path()))
+            return
+        if not accounts:
+            print_failure("Error: no accounts in %s" % accounts_path())
+            return
+        for account in accounts:
+            if not account.password:
+                account.password = getpass.getpass("Password of %s (%s): " % (account.name, account.username))
+        width = max([len("account")] + [len(account.name) for account in accounts])
+        output = ThreadOutput(sys.stdout)
+        started = time.time()
+
+        def run(account):
+            set_account(account)
+            output.local.buffer = []
+            _command_status.failed = False
+            begin = time.time()
+            try:
+                cmd.Cmd.onecmd(self, command)
+                if account.inventory is not None:
+                    account.inventory.save()
+            except Exception as err:
+                print("Error: %s" % error_code(err=err))
+                mark_failed()
+            finally:
+                text = "".join(output.local.buffer)
+                output.local.buffer = None
+                set_account(None)
+            return text, command_failed(), time.time() - begin
+
+        summary = []
+        sys.stdout = output
+        try:
+            for account, result, err in run_ordered(run, accounts, len(accounts)):
+                text, failed, seconds = result
+                for line in text.splitlines():
+                    output.stream.write(tag_account(line, account.name, width) + "\n")
+                output.stream.flush()
+                summary.append((account, failed, seconds))
+        finally:
+            sys.stdout = output.stream
+        print("%s  %-20s %-7s %8s" % ("account".ljust(width), "username", "status", "seconds"))
+        for account, failed, seconds in summary:
+            print("%s  %-20s %-7s %8.2f" % (account.name.ljust(width), account.username,
+                                            "FAILED" if failed else "ok", seconds))
+        failures = len([failed for account, failed, seconds in summary if failed])
+        print("%d accounts, %d failed in %.1fs." % (len(summary), failures, time.time() - started))
+        if failures:
+            mark_failed()
+
+    # sync command
+    def do_sync(self, params):
+        """Make the redirection service match a CSV file, writing only what differs
+            'sync <desired.csv>' register, update and remove phones so that exactly the 'mac,url' rows of <desired.csv> are redirected
+            'sync <desired.csv> --keep' do not remove registered phones missing from <desired.csv>
+            'sync <desired.csv> --dry-run' only print the plan
+            rows without an url use the default url (see the 'defaults' command)
+        """
+        args = params.split()
+        keep = "--keep" in args
+        dry_run = "--dry-run" in args
+        args = [arg for arg in args if arg not in ("--keep", "--dry-run")]
+        if len(args) != 1:
+            print_failure("Wrong arguments. Use 'sync desired.csv [--keep] [--dry-run]'")
+            return
+        if not os.path.isfile(args[0]):
+            print_failure("Error: file %s not found" % args[0])
+            return
+
+        if get_cache_mode() == "auto":
+            # a plan must be computed from the current state, unless '--cached' is explicitly given
+            set_cache_mode("fresh")
+        started = time.time()
+        desired = {}
+        invalid = set()
+        for mac, url in read_mac_csv(args[0]):
+            url = replace_value(url) or defaults["url"]
+            if not classify_mac(mac) or not url:
+                print("Skipping invalid row: %s,%s" % (mac, url))
+                # the phone is listed, just not usable: never remove it
+                invalid.add(mac)
+                continue
+            desired[mac] = url
+
+        print("Fetching current state ...")
+        current = {}
+        conflicts = {}
+        if keep:
+            macs = sorted(desired)
+        else:
+            errors = {}
+            macs = list(iter_phones(models, errors=errors))
+            if errors:
+                for model in errors:
+                    print_failure("Error listing %s phones: %s" % (model, error_message(errors[model])))
+                print("Current state incomplete, nothing done.")
+                return
+        for mac, redirection in iter_redirections(macs):
+            if redirection and redirection[0] == True:
+                current[mac.upper()] = redirection[2] or ''
+            elif not redirection or redirection[1] != "Error:no_such_mac":
+                conflicts[mac.upper()] = redirection[1] if redirection else "Error"
+        for mac in conflicts:
+            desired.pop(mac, None)
+        add, change, remove, unchanged = sync_plan(desired, current, invalid)
+        if keep:
+            remove = []
+
+        print("Sync plan for %s (state fetched in %.1fs):" % (args[0], time.time() - started))
+        print("  add       %8d  (%d RPCs)" % (len(add), len(add)))
+        print("  change    %8d  (%d RPCs)" % (len(change), 2 * len(change)))
+        print("  remove    %8d  (%d RPCs)" % (len(remove), len(remove)))
+        print("  unchanged %8d" % len(unchanged))
+        if conflicts or invalid:
+            print("  skipped   %8d  (invalid rows or phones that cannot be checked)" % (len(conflicts) + len(invalid)))
+        print("  total RPCs: %d" % (len(add) + 2 * len(change) + len(remove)))
+        if dry_run or not (add or change or remove):
+            return
+
+        def apply(action):
+            kind, mac = action
+            conn = get_server()
+            if kind != "add":
+                result = conn.redirect.deregisterPhone(mac)
+                if kind == "remove" or not result[0]:
+                    return result
+            return conn.redirect.registerPhone(mac, desired[mac])
+
+        actions = [("add", mac) for mac in add] + [("change", mac) for mac in change] + [("remove", mac) for mac in remove]
+        progress = Progress("Synced", len(actions))
+        errors = {}
+        failed = 0
+        inv = get_inventory()
+        for (kind, mac), result, err in run_parallel(apply, actions):
+            progress.update()
+            if err is None and result[0]:
+                if kind == "remove":
+                    inv.remove(mac)
+                else:
+                    inv.add(mac)
+                continue
+            failed += 1
+            inv.forget(mac)
+            code = error_code(result, err)
+            errors[code] = errors.get(code, 0) + 1
+            progress.message("%s (%s): %s" % (mac, kind, error_message(code)))
+        progress.finish()
+        print("%d changes applied, %d failed." % (len(actions) - failed, failed))
+        print_error_summary(errors)
+
+    # migrate command
+    def do_migrate(self, params):
+        """Move every phone redirected to one url to another url
+            'migrate <old_url> <new_url> [<phone_type> ...]' re-register to <new_url> all phones redirected to <old_url>,
+                                                           optionally only phones of the given types (Eg. "migrate http://old.example.com/ http://new.example.com/")
+            an interrupted migration is resumed by running the same command again
+        """
+        args = list(map(replace_value, params.split()))
+        if len(args) < 2:
+            print_failure("Wrong arguments. Use 'migrate old_url new_url [phone_type ...]'")
+            return
+        old_url, new_url = args[0], args[1]
+        model_list = args[2:] or models
+        for model in model_list:
+            if model not in models:
+                print_failure("Error: model %s not found" % model)
+                return
+
+        journal = find_unfinished_job("migrate", args)
+        if journal is None:
+            journal = Journal.create("migrate", args)
+        self._migrate(journal, old_url, new_url, model_list)
+
+    def _migrate(self, journal, old_url, new_url, model_list):
+        """ Run the migrate job of 'journal', continuing the phones it left in progress """
+        resumed = journal.pending()
+        if resumed:
+            print("Resuming job %s: %d phones were left in progress." % (journal.job, len(resumed)))
+
+        # phones interrupted between deregister and register are no longer listed under old_url,
+        # they go to the target url of their journaled intent
+        by_model = {}
+        targets = {}
+        for mac, operation, url in resumed:
+            by_model.setdefault(classify_mac(mac), set()).add(mac)
+            targets[mac] = url or new_url
+        print("Searching phones redirected to %s ..." % old_url)
+        started = time.time()
+
+        def find(model):
+            return get_server().redirect.listPhones(model, old_url)
+
+        for model, result, err in run_parallel(find, model_list):
+            if err is not None or (len(result) > 0 and not result[0]):
+                code = error_code(result, err)
+                print_failure("Error listing %s phones: %s" % (model, error_message(code)))
+                continue
+            by_model.setdefault(model, set()).update(mac.upper() for mac in result)
+        total = sum(len(macs) for macs in by_model.values())
+        print("%d phones to migrate, found in %.1fs." % (total, time.time() - started))
+        if not total:
+            journal.finish()
+            return
+
+        def migrate(mac):
+            url = targets.get(mac, new_url)
+            journal.intent(mac, "update", url)
+            conn = get_server()
+            conn.redirect.deregisterPhone(mac)
+            return conn.redirect.registerPhone(mac, url)
+
+        actions = [mac for model in models if model in by_model for mac in sorted(by_model[model])]
+        remaining = dict((model, len(macs)) for model, macs in by_model.items())
+        model_started = dict((model, time.time()) for model in by_model)
+        model_failed = {}
+        progress = Progress("Migrated", total)
+        errors = {}
+        inv = get_inventory()
+        for mac, result, err in run_parallel(migrate, actions):
+            model = classify_mac(mac)
+            progress.update()
+            if err is None and result[0]:
+                journal.outcome(mac)
+                inv.add(mac)
+            else:
+                code = error_code(result, err)
+                journal.outcome(mac, code, not is_final(err))
+                inv.forget(mac)
+                errors[code] = errors.get(code, 0) + 1
+                model_failed[model] = model_failed.get(model, 0) + 1
+                progress.message("%s: %s" % (mac, error_message(code)))
+            remaining[model] -= 1
+            if not remaining[model]:
+                progress.message("%-12s %6d phones migrated, %d failed in %.1fs" % (
+                    model, len(by_model[model]) - model_failed.get(model, 0), model_failed.get(model, 0),
+                    time.time() - model_started[model]))
+        progress.finish()
+        print_error_summary(errors)
+        if errors:
+            journal.close()
+            print("Run the same command again to retry the failed phones (job %s)." % journal.job)
+        else:
+            journal.finish()
+
+    # update command
+    def do_update(self, params):
+        """Update phones in redirection service
+            'update <mac> <url>' modify redirection to <url> for mac address <mac> (Eg. "add 000413XXXXXX http://server.example.com"'
+        """
+        args = params.split()
+        if len(args) != 2:
+            print_failure("Wrong arguments. Use 'update mac_address target_url'")
+            return
+        if not validate_mac(args[0]):
+            print_failure("%s does not seem to be a valid snom MAC address." % args[0])
+            return
+        print("Updating redirection for %s to %s." % (args[0], args[1]))
+        get_server().redirect.deregisterPhone(args[0])
+        result = get_server().redirect.registerPhone(args[0], args[1])
+        if result[0]:
+            get_inventory().add(args[0])
+            print("Redirection to %s for %s with MAC address %s has been successfully updated." % (args[1], get_type(args[0]), args[0]))
+        else:
+            get_inventory().forget(args[0])
+            print_error(result)
+            return
+
+    # remove command
+    def do_remove(self, params):
+        """Remove phone from redirection service
+            'remove <mac>' remove redirection for mac address <mac> (Eg. "remove 000413XXXXXX"'
+        """
+        args = params.split()
+        if len(args) != 1:
+            print_failure("Wrong arguments. Use 'remove mac_address'")
+            return
+        if not validate_mac(args[0]):
+            print_failure("%s does not seem to be a valid snom MAC address." % args[0])
+            return
+
+        result = get_server().redirect.deregisterPhone(args[0])
+        if result[0]:
+            get_inventory().remove(args[0])
+            print("Successfully removed redirection for %s with MAC address %s." % (get_type(args[0]), args[0]))
+        else:
+            print_error(result)
+            return
+
+    # check command
+    def do_check(self, params):
+        """Verify redirection for a specific mac address
+            'check <mac>' verify redirection for mac address <mac> (Eg. "check 000413XXXXXX")
+            'check <mac> <mac> ... | @<file>' verify many MACs at once, given inline and/or listed in <file>,
+                                           and print one table row per distinct MAC
+            '--format table|jsonl' print the rows as an aligned table (default) or JSON lines
+        """
+        args = params.split()
+        if len(args) > 1 or (args and args[0].startswith("@")):
+            return self._check_many(args)
+        if len(args) == 1:
+            mac = args[0].upper()
+            inv = get_inventory()
+            target = inv.redirection(mac)
+            if target is not None:
+                result = [True]
+            else:
+                result = get_server().redirect.checkPhone(mac)
+            if result[0]:
+                if target is None:
+                    target = get_server().redirect.getPhoneRedirection(mac)
+                    if target[0] == True:
+                        inv.store_redirection(mac, target)
+                print("%s with MAC address %s is registered." % (get_type(mac), mac))
+                if target[0] == True:
+                    if target[1] != '':
+                        print("\tMac is owned by %s" % target[1])
+                    if target[2] != '':
+                        print("\tCurrent redirection target is: %s" % target[2])
+                    else:
+                        print("\tThe mac is not redirected")
+                else:
+                    print_failure("\tError getting the redirection target: %s" % target[1])
+            else:
+                if result[1] == "Error:no_such_mac":
+                    inv.remove(mac)
+                print_error(result)
+        else:
+            print_failure("Wrong arguments. Use 'check MAC_Address'")
+
+    def _check_many(self, args):
+        output = "table"
+        if "--format" in args:
+            index = args.index("--format")
+            output = args[index + 1] if index + 1 < len(args) else None
+            del args[index:index + 2]
+        if output not in ("table", "jsonl") or not args:
+            print_failure("Wrong arguments. Use 'check MAC_Address|@file ... [--format table|jsonl]'")
+            return
+        started = time.time()
+        lines = []
+        for arg in args:
+            if arg.startswith("@"):
+                try:
+                    with open(arg[1:]) as macfile:
+                        lines.extend(macfile.readlines())
+                except (IOError, OSError) as err:
+                    print_failure("Error: %s" % err)
+                    return
+            else:
+                lines.append(arg)
+        rows = []
+        for line, mac, model, error in scan_macs(lines):
+            if error != "Error:duplicate_mac":
+                rows.append([mac or line.split(",")[0].strip(), model, error, None, None])
+        pending = [row for row in rows if row[2] is None]
+        inv = get_inventory()
+        for row, (mac, redirection) in zip(pending, iter_redirections(row[0] for row in pending)):
+            if redirection is None:
+                row[2] = "Error:request_failed"
+            elif redirection[0] == True:
+                row[3], row[4] = redirection[1], redirection[2]
+            else:
+                row[2] = redirection[1] if len(redirection) > 1 else "%s" % (redirection,)
+                if row[2] == "Error:no_such_mac":
+                    inv.remove(mac)
+        # a phone can be registered although its redirection could not be read
+        unclear = [row for row in pending if row[2] not in (None, "Error:no_such_mac", "Error:owned_by_other_user")]
+        for row, result in zip(unclear, multicall("redirect.checkPhone", [(row[0],) for row in unclear])):
+            if result is not None and result[0]:
+                row[2], row[3], row[4] = "registered", None, None
+        for row in rows:
+            if row[2] is None:
+                row[2] = "registered"
+        if output == "jsonl":
+            for mac, model, status, company, url in rows:
+                print(json.dumps({"mac": mac, "model": model, "status": status, "company": company, "url": url}))
+        else:
+            table = [(mac, model or "-", status if status == "registered" else error_message(status),
+                      company or "-", url or "-") for mac, model, status, company, url in rows]
+            header = ("mac", "model", "status", "company", "url")
+            widths = [max([len(header[n])] + [len(row[n]) for row in table]) for n in range(4)]
+            for row in [header] + table:
+                print("  ".join(value.ljust(width) for value, width in zip(row, widths)) + "  " + row[4])
+        registered = len([row for row in rows if row[2] == "registered"])
+        stream = sys.stderr if output == "jsonl" else sys.stdout
+        stream.write("%d phones checked, %d registered, %d not in %.1fs.\n" % (
+            len(rows), registered, len(rows) - registered, time.time() - started))
+        if registered < len(rows):
+            mark_failed()
+
+    # watch command
+    def do_watch(self, params):
+        """Report changes of the redirection, owner or registration of phones
+            'watch <file>' poll the MACs listed in <file> and print every change (Eg. "watch phones.csv")
+            'watch <phone_type> ...' poll the phones of the given models, also reporting phones added to them
+            '--interval <seconds>' shortest poll interval of a MAC (default 60), models are re-listed at this interval
+            '--max-interval <seconds>' longest poll interval (default 3600): the interval of a MAC doubles after each
+                                       unchanged poll and falls back to the shortest one when it changed
+            '--sweeps <n>' stop after <n> polling rounds instead of at Ctrl-C
+            '--format table|jsonl' print the changes as lines of text (default) or JSON lines
+        """
+        args = params.split()
+        options = {"--interval": "60", "--max-interval": "3600", "--sweeps": "0", "--format": "table"}
+        for option in options:
+            if option in args:
+                index = args.index(option)
+                if index + 1 >= len(args):
+                    args = []
+                    break
+                options[option] = args[index + 1]
+                del args[index:index + 2]
+        try:
+            shortest = float(options["--interval"])
+            longest = max(shortest, float(options["--max-interval"]))
+            sweeps = int(options["--sweeps"])
+        except ValueError:
+            args = []
+        if not args or options["--format"] not in ("table", "jsonl"):
+            print_failure("Wrong arguments. Use 'watch file|phone_type ... [--interval s] [--max-interval s] "
+                          "[--sweeps n] [--format table|jsonl]'")
+            return
+
+        def note(line):
+            # keep a JSON lines output parseable
+            stream = sys.stderr if options["--format"] == "jsonl" else sys.stdout
+            stream.write(line + "\n")
+
+        def failure(line):
+            note(line)
+            mark_failed()
+
+        if len(args) == 1 and os.path.isfile(args[0]):
+            with open(args[0]) as macfile:
+                macs = [mac for line, mac, model, error in scan_macs(macfile) if error is None]
+            model_list = []
+        else:
+            model_list = args
+            for model in model_list:
+                if model not in models:
+                    failure("Error: %s is neither a file nor a phone type" % model)
+                    return
+            macs = []
+
+        def emit(now, mac, field, old, new):
+            if options["--format"] == "jsonl":
+                print(json.dumps({"time": now, "mac": mac, "model": classify_mac(mac),
+                                  "field": field, "old": old, "new": new}))
+            else:
+                print("%s %s %-10s %s: %s -> %s" % (time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(now)),
+                                                  mac, classify_mac(mac), field, old, new))
+            sys.stdout.flush()
+
+        schedule = WatchSchedule(shortest, longest)
+        states = {}
+        inv = get_inventory()
+        listed = None
+        polls = listings = changes = sweep = 0
+        started = time.time()
+        for mac in macs:
+            schedule.add(mac, started)
+        try:
+            while True:
+                now = time.time()
+                if model_list and (listed is None or now - listed >= shortest):
+                    phones, errors = list_phones(model_list, fresh=True)
+                    listings += len(model_list)
+                    for model in errors:
+                        failure("Error listing %s phones: %s" % (model, error_message(errors[model])))
+                    for mac in phones:
+                        mac = mac.upper()
+                        if listed is not None and mac not in schedule.intervals:
+                            emit(now, mac, "listed", None, "registered")
+                            changes += 1
+                        schedule.add(mac, now)
+                    listed = now
+                due = schedule.due(now)
+                if due:
+                    results = multicall("redirect.getPhoneRedirection", [(mac,) for mac in due])
+                    polls += len(due)
+                    for mac, redirection in zip(due, results):
+                        if redirection is None:
+                            schedule.polled(mac, now, failed=True)
+                            continue
+                        if redirection[0] == True:
+                            inv.store_redirection(mac, redirection)
+                        elif redirection[1] == "Error:no_such_mac":
+                            inv.remove(mac)
+                        state = redirection_state(redirection)
+                        old = states.get(mac)
+                        changed = False
+                        if old is not None and old != state:
+                            changed = True
+                            changes += 1
+                            if old[0] != state[0]:
+                                emit(now, mac, "state", old[0], state[0])
+                            else:
+                                for field, before, after in zip(("company", "url"), old[1:], state[1:]):
+                                    if before != after:
+                                        emit(now, mac, field, before, after)
+                        states[mac] = state
+                        schedule.polled(mac, now, changed)
+                    sweep += 1
+                    if sweep == 1:
+                        note("Watching %d phones, %d registered." % (
+                            len(schedule), len([state for state in states.values() if state[0] == "registered"])))
+                    if sweep == sweeps:
+                        break
+                wake = schedule.next_time()
+                if model_list:
+                    wake = min(wake or listed + shortest, listed + shortest)
+                if wake is None:
+                    note("Nothing to watch.")
+                    break
+                # short sleeps keep Ctrl-C responsive
+                while time.time() < wake:
+                    time.sleep(min(1.0, max(0.0, wake - time.time())))
+        except KeyboardInterrupt:
+            note("")
+        note("%d changes in %d sweeps, %d phone polls and %d model listings in %.0fs." % (
+            changes, sweep, polls, listings, time.time() - started))
+
+    # refresh command
+    def do_refresh(self, params):
+        """Refresh the local inventory cache
+            'refresh' re-fetch all stale model listings and phone redirections
+            'refresh <phone_type>|<mac> ...' re-fetch only the given models or MACs, if stale (Eg. "refresh snom370 snomD785")
+            'refresh --fresh ...' re-fetch entries even if they are younger than the cache TTL (see 'defaults cachettl <seconds>')
+        """
+        model_list = []
+        macs = []
+        for arg in params.split():
+            if arg in models:
+                model_list.append(arg)
+            elif classify_mac(arg):
+                macs.append(arg.upper())
+            else:
+                print_failure("Error: %s is neither a phone model nor a known snom MAC address" % arg)
+                return
+        if not model_list and not macs:
+            model_list = models
+        started = time.time()
+        inv = get_inventory()
+        stale_models = inv.stale_models(model_list)
+        result, errors = list_phones(stale_models)
+        for model in errors:
+            print_failure("Error listing %s phones: %s" % (model, error_message(errors[model])))
+        stale_macs = [mac for mac in macs if inv.redirection(mac) is None]
+        if model_list:
+            stale_macs.extend(inv.stale_macs(model_list))
+        redirections = get_redirections(stale_macs)
+        failed = len([r for r in redirections if not r or r[0] != True])
+        print("Refreshed %d model listings and %d phone redirections (%d failed) in %.1fs." % (
+            len(stale_models) - len(errors), len(stale_macs) - failed, failed, time.time() - started))
+    # report command
+    def do_report(self, params):
+        """Count the phones of the inventory cache per model, company and/or redirection url
+            'report' count the phones per model
+            'report <field> ...' count the phones per combination of the fields model, company and url (Eg. "report model url")
+            'report ... --snapshot <file>' count the phones of a snapshot file instead (see 'snapshot')
+            phones whose redirection was never fetched are counted under '-', 'refresh' fetches them
+        """
+        args = params.split()
+        path = None
+        if "--snapshot" in args:
+            index = args.index("--snapshot")
+            if index + 1 >= len(args):
+                print_failure("Wrong arguments. Use 'report [model|company|url ...] [--snapshot file]'")
+                return
+            path = args[index + 1]
+            del args[index:index + 2]
+        keys = args or ["model"]
+        for key in keys:
+            if key not in ("model", "company", "url"):
+                print_failure("Error: unknown field %s, use model, company or url" % key)
+                return
+        if path is not None:
+            try:
+                table = Snapshot(path)
+            except (IOError, OSError, ValueError) as err:
+                print_failure("Error: %s" % err)
+                return
+        else:
+            table = get_inventory().table
+        try:
+            groups = group_counts(table, keys)
+        finally:
+            if path is not None:
+                table.close()
+        widths = [max([len(key)] + [len(values[n] or "-") for values, count in groups]) for n, key in enumerate(keys)]
+        print("  ".join(key.ljust(width) for key, width in zip(keys, widths)) + "  %8s" % "phones")
+        for values, count in groups:
+            print("  ".join((value or "-").ljust(width) for value, width in zip(values, widths)) + "  %8d" % count)
+        print("%d phones in %d groups." % (sum(count for values, count in groups), len(groups)))
+
+    # snapshot command
+    def do_snapshot(self, params):
+        """Save or load a binary snapshot of the inventory cache
+            'snapshot save <file>' write the inventory cache to <file>, a file whose columns can be memory-mapped
+                                   for offline analysis (the layout is described in snomcli.py)
+            'snapshot load <file>' replace the inventory cache with the phones of <file>
+            'snapshot info <file>' print the user, date and size of <file>
+        """
+        args = params.split()
+        if len(args) != 2 or args[0] not in ("save", "load", "info"):
+            print_failure("Wrong arguments. Use 'snapshot save|load|info file'")
+            return
+        inv = get_inventory()
+        if args[0] == "save":
+            try:
+                with inv._lock:
+                    save_snapshot(args[1], inv.table, inv.username, inv.models)
+            except (IOError, OSError) as err:
+                print_failure("Error: %s" % err)
+                return
+            print("%d phones written to %s." % (len(inv.table), args[1]))
+            return
+        try:
+            snapshot = Snapshot(args[1])
+        except (IOError, OSError, ValueError) as err:
+            print_failure("Error: %s" % err)
+            return
+        try:
+            if args[0] == "info":
+                print("%s: %d phones of %s, taken %s" % (args[1], len(snapshot), snapshot.username,
+                                                        time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(snapshot.created))))
+            elif snapshot.username != inv.username:
+                print_failure("Error: the snapshot holds the phones of %s" % snapshot.username)
+            else:
+                with inv._lock:
+                    inv.table = snapshot.to_table()
+                    inv.models = dict(snapshot.listings)
+                    inv.orders = {}
+                    inv.dirty = True
+                    inv.generation += 1
+                print("%d phones loaded from %s." % (len(inv.table), args[1]))
+        finally:
+            snapshot.close()
+
+    # stats command
+    def do_stats(self, params):
+        """Show the RPC statistics of the session
+            'stats' print calls, errors, bytes and latency per XML-RPC method
+            'stats reset' clear the statistics
+            'stats json <file>' write the statistics as JSON to <file>
+            'stats prometheus <file>' write the statistics in Prometheus text format to <file>
+        """
+        args = params.split()
+        if not args:
+            print("\n".join(rpc_stats.lines()))
+            print(scheduler.line())
+        elif args == ["reset"]:
+            rpc_stats.reset()
+            print("Statistics cleared.")
+        elif len(args) == 2 and args[0] in ("json", "prometheus"):
+            try:
+                rpc_stats.export(args[1], args[0])
+            except (IOError, OSError) as err:
+                print_failure("Error writing %s: %s" % (args[1], err))
+                return
+            print("Statistics written to %s." % args[1])
+        else:
+            print_failure("Wrong arguments. Use 'stats', 'stats reset' or 'stats json|prometheus <file>'")
+
+    # type command
+    def do_type(self, params):
+        """Get the devie type of a given mac address
+            'type <mac>' returns the device type of the mac address <mac>
+        """
+        args = params.split()
+        for mac in args:
+            print("%s: %s" % (mac, get_type(normalize_mac(mac) or mac)))
+
+    # validate command
+    def do_validate(self, params):
+        """Check, normalize and deduplicate a file of MAC addresses
+            'validate <file>' count the valid, duplicate and rejected MACs of <file> per phone type
+            'validate <file> <clean> [<rejected>]' also write the unique valid MACs to <clean> and the other lines,
+                                                   prefixed with the reason, to <rejected> ('-' prints to the console)
+            MACs may be written 000413AABBCC, 00:04:13:aa:bb:cc, 00-04-13-AA-BB-CC or 0004.13aa.bbcc,
+            the rest of a 'mac,...' line is kept (Eg. "validate warehouse.txt phones.csv" before "import phones.csv")
+        """
+        args = params.split()
+        if len(args) not in (1, 2, 3):
+            print_failure("Wrong arguments. Use 'validate file [clean_file [rejected_file]]'")
+            return
+        if not os.path.isfile(args[0]):
+            print_failure("Error: file %s not found" % args[0])
+            return
+        outputs = []
+        try:
+            for path in args[1:]:
+                outputs.append(sys.stdout if path == "-" else open(path, "w"))
+        except (IOError, OSError) as err:
+            print_failure("Error: %s" % err)
+            for output in outputs:
+                if output is not sys.stdout:
+                    output.close()
+            return
+        clean = outputs[0].write if len(outputs) > 0 else None
+        rejected = outputs[1].write if len(outputs) > 1 else None
+
+        per_model = {}
+        errors = {}
+        progress = Progress("Validated")
+        try:
+            with open(args[0]) as macfile:
+                for line, mac, model, error in scan_macs(macfile):
+                    if error is None:
+                        per_model[model] = per_model.get(model, 0) + 1
+                        if clean:
+                            _, sep, rest = line.partition(",")
+                            clean(mac + sep + rest + "\n")
+                    else:
+                        errors[error] = errors.get(error, 0) + 1
+                        if rejected:
+                            rejected("%s\t%s\n" % (error_message(error), line))
+                    progress.count += 1
+                    if not progress.count & 0xFFFF:
+                        progress.update(0)
+        finally:
+            for output in outputs:
+                if output is not sys.stdout:
+                    output.close()
+        progress.finish()
+        print("%d valid, %d duplicate, %d malformed, %d unknown." % (
+            sum(per_model.values()), errors.get("Error:duplicate_mac", 0),
+            errors.get("Error:malformed_mac", 0), errors.get("Error:unknown_model", 0)))
+        for model in models:
+            if model in per_model:
+                print("  %-12s %8d" % (model, per_model[model]))
+
+    # set command
+    def do_set(self, params):
+        """Set a variable value
+            'set <var_name> <value>' set a variable <var_name> to value <value> (Eg. "set server http://my.server.example.com/provscript.php)"
+        """
+        args = params.split()
+        if len(args) == 2:
+            set_var(args[0], args[1])
+            return
+        else:
+            print_failure("Wrong arguments. Use 'set <var_name> <value>'")
+            return
+
+    # print command
+    def do_print(self, params):
+        """Print local variables
+            'print all' print all defined variables
+            'print <var_name>' print local variable <var_name>
+        """
+        args = params.split()
+        if len(args) == 1:
+            if args[0] == "all":
+                print("\nLocal variables:")
+                print("================")
+                if len(local_vars) == 0:
+                    print("\nNo local variables defined. Use 'set var_name var_value' to define variables.")
+                else:
+                    print("\n".join(["%s = %s" % (var, local_vars[var]) for var in local_vars]))
+                print("")
+            else:
+                if args[0] in local_vars:
+                    print("%s = %s" % (args[0], local_vars[args[0]]))
+                else:
+                    print_failure("Unknown variable %s" % args[0])
+        else:
+            print_failure("Wrong arguments. Use 'print var_name or print all")
+
+    def do_defaults(self, params):
+        """Manage default settings
+            'defaults print' print current defaults setting
+            'defaults store' store all current settings in configuration file
+            'defaults <setting> <value>' store single setting in configuration file
+            'defaults credttl <seconds>' keep a typed password in plain text in ~/.snomcli_session for <seconds>
+                                         so later invocations do not prompt (default 0: never stored)
+        """
+        args = params.split()
+        if len(args) == 1:
+            if args[0] == "print":
+                print("\nCurrent default settings:")
+                print("-------------------------")
+                print("\n".join(["%s => %s" % (x.ljust(10), defaults[x]) for x in defaults]))
+            elif args[0] == "store":
+                store_defaults()
+                print("Defaults written...")
+            else:
+                var = args[0]
+                if var in defaults:
+                    defaults[var] = ''
+                    print("Removed value for %s" % var)
+                    store_defaults()
+                else:
+                    print_failure("Default setting not found: %s" % var)
+        elif len(args) == 2:
+            var = args[0]
+            val = args[1]
+            if var in defaults:
+                defaults[var] = val
+                print("Changed default value %s to %s" % (var, val))
+                store_defaults()
+            else:
+                print_failure("Default setting not found: %s" % var)
+        else:
+            print_failure("Wrong arguments. Use 'defaults [name] [value]' or 'defaults print'.")
+
+    def do_history(self, args):
+        """Print a list of commands that have been entered"""
+        print("\n".join(self._history))
+
+    def do_exit(self, args):
+        """Exits from the console"""
+        return True
+
+    ## Command definitions to support Cmd object functionality ##
+    def do_EOF(self, args):
+        """Exit on system end of file character"""
+        return self.do_exit(args)
+
+    def do_help(self, args):
+        """Get help on commands
+           'help' or '?' with no arguments prints a list of commands for which help is available
+           'help <command>' or '? <command>' gives help on <command>
+            """
+        # The only reason to define this method is for the help text in the doc
+        # string
+        if args and not hasattr(self, "do_" + args) and not hasattr(self, "help_" + args):
+            print_failure("*** No help on %s" % args)
+            return
+        cmd.Cmd.do_help(self, args)
+
+    def do_version(self, args):
+        """Print the sofware version"""
+        print("Version: %s" % __version__)
+
+    def emptyline(self):
+        pass
+
+    def default(self, line):
+        print_failure("*** Unknown syntax: %s" % line)
+
+    def onecmd(self, line):
+        # '--cached' and '--fresh' select how the inventory cache is used for this command
+        args = line.split()
+        if "--cached" in args or "--fresh" in args:
+            set_cache_mode("fresh" if "--fresh" in args else "cached")
+            line = " ".join([arg for arg in args if arg not in ("--cached", "--fresh")])
+        _command_status.failed = False
+        try:
+            return cmd.Cmd.onecmd(self, line)
+        finally:
+            set_cache_mode("auto")
+            if inventory is not None:
+                try:
+                    inventory.save()
+                except (IOError, OSError) as err:
+                    print("Error writing the inventory cache: %s" % err)
+
+    def precmd(self, params):
+        if params.strip() != "":
+            self._history += [params.strip()]
+        replaced = list(map(replace_value, params.split()))
+        return ' '.join(replaced)
+
+    # Tab completion of the arguments: the kinds of values accepted at each position
+    # ("mac", "model", "all"...), the last entry applies to the further arguments.
+    # A word starting with '%' completes with the names of the local variables.
+    argument_kinds = {
+        "add": [["mac"], []],
+        "update": [["mac"], []],
+        "remove": [["mac"]],
+        "check": [["mac", "--format"]],
+        "type": [["mac"]],
+        "refresh": [["model", "mac", "--fresh"]],
+        "list": [["model", "all"], ["--inventory", "--format"], []],
+        "migrate": [[], [], ["model"]],
+        "set": [["variable"], []],
+        "print": [["variable", "all"]],
+        "defaults": [["setting", "print", "store"], []],
+        "resume": [["job"]],
+        "accounts": [["all"], []],
+        "jobs": [["all", "clean"]],
+        "stats": [["reset", "json", "prometheus"], []],
+        "report": [["model", "company", "url", "--snapshot"]],
+        "watch": [["model", "--interval", "--max-interval", "--sweeps", "--format"]],
+        "snapshot": [["save", "load", "info"], []],
+    }
+
+    def _complete(self, text, line, begidx):
+        if text.startswith("%"):
+            return ["%" + name for name in sorted(local_vars) if name.startswith(text[1:])]
+        words = line[:begidx].split()
+        kinds = self.argument_kinds.get(words[0] if words else "", [[]])
+        kinds = kinds[min(len(words) - 1, len(kinds) - 1)]
+        matches = []
+        for kind in kinds:
+            if kind == "mac":
+                matches.extend(complete_macs(text))
+            elif kind == "model":
+                matches.extend(model for model in models if model.startswith(text))
+            elif kind == "variable":
+                matches.extend(name for name in sorted(local_vars) if name.startswith(text))
+            elif kind == "setting":
+                matches.extend(name for name in sorted(defaults) if name.startswith(text))
+            elif kind == "job":
+                matches.extend(job for job in job_names() if job.startswith(text))
+            elif kind.startswith(text):
+                matches.append(kind)
+        return matches
+
+    def completedefault(self, text, line, begidx, endidx):
+        return self._complete(text, line, begidx)
+
+    def get_names(self):
+        ret = []
+        for d in dir(self.__class__):
+            if d == "do_EOF":
+                continue
+            ret.append(d)
+        return ret
+
+# Batch mode
+#
+# A script is run over the single authenticated session of the console.
+# Commands working on one MAC (add, update, remove, check) are pipelined:
+# up to 'workers' of them run concurrently, unless an earlier command in
+# flight uses the same MAC. Every other command is a barrier: it waits for
+# the commands in flight and runs alone, so 'set' and %var substitution keep
+# their sequential semantics. Outputs are printed in script order.
+
+PIPELINED_COMMANDS = ("add", "update", "remove", "check")
+
+
+class ThreadOutput(object):
+    """ sys.stdout replacement sending the output of each batch command to its own buffer """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def write(self, data):
+        buf = getattr(self.local, "buffer", None)
+        if buf is None:
+            self.stream.write(data)
+        else:
+            buf.append(data)
+
+    def flush(self):
+        self.stream.flush()
+
+    def isatty(self):
+        # progress counters are meaningless inside a batch transcript
+        return False
+
+
+def run_script(console, lines):
+    """ Run the commands of 'lines' on 'console'. Returns the exit status: 0 if every command succeeded. """
+    output = ThreadOutput(sys.stdout)
+    limit = threading.Semaphore(get_workers())
+    results = []        # [line number, command, output, failed, seconds, thread]
+    busy = {}           # mac -> thread of the command in flight using it
+    printed = [0]
+    started = time.time()
+
+    def execute(result):
+        output.local.buffer = []
+        begin = time.time()
+        stop = False
+        try:
+            stop = console.onecmd(result[1])
+            result[3] = command_failed()
+        except Exception as err:
+            print("Error: %s" % error_code(err=err))
+            result[3] = True
+        finally:
+            result[4] = time.time() - begin
+            result[2] = "".join(output.local.buffer)
+            output.local.buffer = None
+        return stop
+
+    def run_pipelined(result):
+        try:
+            execute(result)
+        finally:
+            limit.release()
+
+    def flush_done():
+        while printed[0] < len(results) and (results[printed[0]][5] is None or not results[printed[0]][5].is_alive()):
+            number, line, text, failed, seconds, thread = results[printed[0]]
+            output.stream.write("--- %d: %s (%s, %.2fs)\n" % (number, line, "FAILED" if failed else "ok", seconds))
+            output.stream.write(text)
+            printed[0] += 1
+        output.stream.flush()
+
+    def wait_all():
+        for result in results:
+            if result[5] is not None:
+                result[5].join()
+        busy.clear()
+
+    sys.stdout = output
+    try:
+        for number, line in enumerate(lines, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            line = console.precmd(line)
+            args = line.split()
+            result = [number, line, "", False, 0.0, None]
+            results.append(result)
+            if args[0] in PIPELINED_COMMANDS:
+                macs = [arg.upper() for arg in args[1:] if classify_mac(arg)]
+                for mac in macs:
+                    if mac in busy:
+                        busy[mac].join()
+                limit.acquire()
+                thread = threading.Thread(target=run_pipelined, args=(result,))
+                thread.daemon = True
+                result[5] = thread
+                for mac in macs:
+                    busy[mac] = thread
+                thread.start()
+            else:
+                wait_all()
+                if execute(result):
+                    break
+            flush_done()
+        wait_all()
+        flush_done()
+    finally:
+        sys.stdout = output.stream
+    failed = [result for result in results if result[3]]
+    print("%d commands, %d failed in %.1fs." % (len(results), len(failed), time.time() - started))
+    for result in failed:
+        print("  line %d: %s" % (result[0], result[1]))
+    return 1 if failed else 0
+
+
+# Main application loop
+
+# commands working without the server: one-shot invocations of these skip the login
+LOCAL_COMMANDS = ("type", "validate", "report", "snapshot", "version", "help", "set", "print", "defaults", "history",
+                  "accounts")
+
+
+def has_tty():
+    try:
+        open("/dev/tty").close()
+        return True
+    except (IOError, OSError):
+        return False
+
+
+def read_tty(prompt):
+    """ input() from the terminal rather than stdin, or None if there is no terminal """
+    try:
+        with open("/dev/tty", "r+") as tty:
+            tty.write(prompt)
+            tty.flush()
+            return tty.readline().rstrip("\r\n")
+    except (IOError, OSError):
+        return None
+
+
+def login(stdin_script=False):
+    """ Return the username and password of the session, prompting for what is not configured.
+    With 'stdin_script' stdin carries the commands: the prompts use the terminal instead. """
+    if stdin_script and not has_tty() and not (defaults["username"] and
+                                               (defaults["password"] or load_credentials(defaults["username"]))):
+        # getpass() would fall back to reading the password from the script
+        print("No terminal to prompt for the credentials: save them with 'defaults username <name>' "
+              "and 'defaults password <password>' to run a script from stdin.")
+        sys.exit(1)
+
+    if not defaults["username"]:
+        user = read_tty("Username: ") if stdin_script else input("Username: ")
+    else:
+        user = defaults["username"]
+
+    password = defaults["password"] or load_credentials(user)
+
+    count = 0
+
+    # Prompt for password
+    while not password:
+
+        password = getpass.getpass("Password: ")
+        pwd_val = validate_password(user, password)
+
+        if not pwd_val:
+            password = None
+            count = count + 1
+            if count == 3:
+                print("Three wrong passwords provided. Exiting.")
+                sys.exit(-1)
+        else:
+            store_credentials(user, password)
+            break
+
+    return user, password
+
+
+def main():
+    """ Entry point of cli.py """
+    global username, banner
+    load_defaults()
+
+    if len(sys.argv) > 3 and sys.argv[1] == "--accounts":
+        # 'cli.py --accounts name,...|all command': the accounts carry their own credentials
+        sys.argv[1] = "accounts"
+    if len(sys.argv) > 1 and sys.argv[1] in LOCAL_COMMANDS:
+        # fast path: the command does not talk to the server, skip the login
+        username = defaults["username"]
+    else:
+        username, password = login(sys.argv[1:] == ["-f", "-"])
+        defaults["username"] = username
+        defaults["password"] = password
+    # the RPC connection is opened by get_server() when a command first needs it
+
+    status = 0
+    try:
+        if len(sys.argv) == 3 and sys.argv[1] == "-f":
+            # batch mode: 'cli.py -f script' or 'cli.py -f -' to read the commands from stdin
+            if sys.argv[2] == "-":
+                status = run_script(RedirectionCli(), sys.stdin)
+            else:
+                with open(sys.argv[2]) as script:
+                    status = run_script(RedirectionCli(), script)
+        elif len(sys.argv) > 1:
+            RedirectionCli().onecmd(' '.join(sys.argv[1:]))
+            status = 1 if command_failed() else 0
+        else:
+            banner = """###############################################
+  Snom Redirection Server Console Ver. %s
+  (c) 2010-2018 snom technology AG
+###############################################""" % __version__
+            setup_readline()
+            RedirectionCli().cmdloop()
+    except KeyboardInterrupt:
+        print("\nGot keyboard interrupt. Exiting...")
+        sys.exit(0)
+    except (IOError, OSError) as err:
+        if err.errno != errno.EPIPE:
+            raise
+        # the reader of the output went away (Eg. 'cli.py list all --format jsonl | head'):
+        # stop quietly, also for the flush at exit
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    finally:
+        if "SNOM_DEBUG" in os.environ:
+            print_pool_stats()
+        if "SNOM_STATS" in os.environ:
+            try:
+                rpc_stats.export(os.environ["SNOM_STATS"])
+            except (IOError, OSError) as err:
+                sys.stderr.write("Error writing %s: %s\n" % (os.environ["SNOM_STATS"], err))
+    sys.exit(status)
@@ -0,0 +1,44 @@
+# vi:si:et:sw=4:sts=4:ts=4
+# -*- coding: UTF-8 -*-
+"""Fixtures running the console against the stand-in server of benchmarks/fakeserver.py"""
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import snomcli
+import fakeserver
+
+
+@pytest.fixture
+def home(tmp_path, monkeypatch):
+    """ An empty home directory for the inventory, jobs and settings files """
+    monkeypatch.setenv("HOME", str(tmp_path))
+    return tmp_path
+
+
+@pytest.fixture
+def server(home, monkeypatch):
+    """ A stand-in server without phones, the console logged in as its user """
+    srv = fakeserver.start(0)
+    monkeypatch.setattr(snomcli, "rpc_url", srv.url)
+    monkeypatch.setattr(snomcli, "defaults", dict(snomcli.defaults))
+    snomcli.defaults["username"] = srv.user
+    snomcli.defaults["password"] = srv.password
+    for name, value in (("username", srv.user), ("banner", ""), ("server", None), ("inventory", None),
+                        ("multicall_supported", True), ("gzip_requests_supported", True),
+                        ("scheduler", snomcli.Scheduler())):
+        monkeypatch.setattr(snomcli, name, value)
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+@pytest.fixture
+def console(server):
+    return snomcli.RedirectionCli()
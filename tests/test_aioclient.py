@@ -0,0 +1,121 @@
+# vi:si:et:sw=4:sts=4:ts=4
+# -*- coding: UTF-8 -*-
+"""The asyncio client against the stand-in server"""
+
+import asyncio
+
+import pytest
+
+import aioclient
+import snomcli
+
+OLD = "http://old.example.com/"
+NEW = "http://new.example.com/"
+
+
+def run(client, coroutine):
+    """ Run 'coroutine' in a new event loop, closing the connections of 'client' at the end """
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        client.close()
+        loop.run_until_complete(asyncio.sleep(0))
+        loop.close()
+
+
+@pytest.fixture
+def client(server):
+    return aioclient.AsyncRedirectionClient(server.url, server.user, server.password, limit=4)
+
+
+def test_read_calls(server, client):
+    server.state.register("000413240001", server.user, "ACME", OLD)
+    server.state.register("000413240002", "someone else", "ACME", OLD)
+    model = snomcli.classify_mac("000413240001")
+
+    async def calls():
+        return [await client.list_phones(model),
+                await client.list_phones(model, NEW),
+                await client.check_phone("000413240001"),
+                await client.check_phone("000413240003"),
+                await client.get_phone_redirection("000413240001"),
+                await client.echo("hello")]
+
+    assert run(client, calls()) == [["000413240001"], [], [True], [False, "Error:no_such_mac"],
+                                    [True, "ACME", OLD], "hello"]
+
+
+def test_error_results(server, client):
+    server.state.register("000413240002", "someone else", "ACME", OLD)
+
+    async def calls():
+        return [await client.get_phone_redirection("000413240003"),
+                await client.get_phone_redirection("000413240002"),
+                await client.get_phone_redirection("001122334455"),
+                await client.list_phones("snomXYZ"),
+                await client.deregister_phone("000413240002")]
+
+    assert run(client, calls()) == [[False, "Error:no_such_mac"], [False, "Error:owned_by_other_user"],
+                            [False, "Error:malformed_mac"], [False, "Error:unknown_model"],
+                            [False, "Error:owned_by_other_user"]]
+    assert server.state.phones["000413240002"][0] == "someone else"
+
+
+def test_write_calls(server, client):
+    server.state.register("000413240001", server.user, "ACME", OLD)
+    phones = server.state.phones
+
+    async def calls():
+        return [await client.register_phone("000413240002", OLD),
+                await client.register_new_phone("000413240001", NEW),
+                await client.register_new_phone("000413240003", NEW),
+                await client.update_phone("000413240001", NEW),
+                await client.update_phone("000413240004", NEW),
+                await client.ensure_phone("000413240003", NEW),
+                await client.ensure_phone("000413240002", NEW),
+                await client.deregister_phone("000413240004")]
+
+    assert run(client, calls()) == [[True], (False, "Error:already_registered"), [True], [True], [True],
+                            [True], (False, "Error:already_registered"), [True]]
+    assert phones["000413240001"][2] == NEW
+    assert phones["000413240002"][2] == OLD
+    assert phones["000413240003"][2] == NEW
+    assert "000413240004" not in phones
+
+
+def test_http_errors(server):
+    client = aioclient.AsyncRedirectionClient(server.url, server.user, "wrong")
+    with pytest.raises(aioclient.ProtocolError) as info:
+        run(client, client.echo("hello"))
+    assert info.value.errcode == 401
+
+    server.error_rate = 1.0
+    client = aioclient.AsyncRedirectionClient(server.url, server.user, server.password)
+    with pytest.raises(aioclient.ProtocolError) as info:
+        run(client, client.echo("hello"))
+    assert info.value.errcode == 503
+
+
+def test_concurrency_limit(server):
+    server.latency = 0.05
+    client = aioclient.AsyncRedirectionClient(server.url, server.user, server.password, limit=3)
+    in_flight = [0, 0]
+    call = client._scheduled_call
+
+    async def counted(*args):
+        in_flight[0] += 1
+        in_flight[1] = max(in_flight)
+        try:
+            return await call(*args)
+        finally:
+            in_flight[0] -= 1
+
+    client._scheduled_call = counted
+    outcomes = []
+    calls = (("%012X" % n, "echo", ("%d" % n,)) for n in range(12))
+    aioclient.run_bulk(client, calls, lambda item, result, err: outcomes.append((item, result, err)), limit=8)
+    assert sorted(outcomes) == [("%012X" % n, "%d" % n, None) for n in range(12)]
+    assert in_flight[1] == 3
+    # the keep-alive connections are reused
+    assert client.connections == 3 and client.requests == 12
@@ -0,0 +1,46 @@
+# vi:si:et:sw=4:sts=4:ts=4
+# -*- coding: UTF-8 -*-
+"""The compiled MAC classifier must agree with the ordered regex scan it replaces"""
+
+import snomcli
+
+
+def regex_type(mac):
+    if not snomcli.macPattern.match(mac):
+        return None
+    for regex, phone in snomcli.macRegexList:
+        if regex.match(mac):
+            return phone
+    return None
+
+
+def test_classify_many_matches_regex_scan():
+    # a sample of both prefixes, both ends of every block of 4096 MACs, the neighbours of every
+    # range of the compiled table and all of the blocks split by finer rules
+    # (benchmarks/bench_classify.py checks every MAC)
+    macs = ["%s%06X" % (oui, n) for oui in ("000413", "00087B") for n in range(0, 1 << 24, 997)]
+    macs += ["%s%06X" % (oui, n | end) for oui in ("000413", "00087B")
+             for n in range(0, 1 << 24, 1 << 12) for end in (0, 0xFFF)]
+    assert snomcli.load_mac_table()
+    macs += ["%012X" % (start + delta) for start in snomcli.macTableStarts[1:] for delta in (-1, 0, 1)]
+    macs += ["%012X" % (block + n) for block in (0x000413840000, 0x00041394B000) for n in range(1 << 12)]
+    mismatches = [(mac, regex_type(mac), phone) for mac, phone in zip(macs, snomcli.classify_many(macs))
+                  if phone != regex_type(mac)]
+    assert mismatches == []
+
+
+def test_classify_mac_matches_regex_scan():
+    for mac in ("000413240000", "00087B080001", "000413B80123", "001122334455", "00041324000"):
+        assert snomcli.classify_mac(mac) == regex_type(mac)
+    assert snomcli.classify_mac("00087b080001") == regex_type("00087B080001")
+
+
+def test_scan_macs_reports_bad_lines():
+    lines = ["mac,url", "00:04:13:24:00:01,http://a/", "zz", "001122334455", "000413240001", "# comment", ""]
+    result = [(mac, model, error) for line, mac, model, error in snomcli.scan_macs(lines)]
+    assert result == [
+        ("000413240001", regex_type("000413240001"), None),
+        (None, None, "Error:malformed_mac"),
+        ("001122334455", None, "Error:unknown_model"),
+        ("000413240001", regex_type("000413240001"), "Error:duplicate_mac"),
+    ]
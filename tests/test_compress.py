@@ -0,0 +1,59 @@
+# vi:si:et:sw=4:sts=4:ts=4
+# -*- coding: UTF-8 -*-
+"""gzip encoded requests, and servers that do not read them"""
+
+import asyncio
+
+import pytest
+
+import aioclient
+import fakeserver
+import snomcli
+
+URL = "http://provisioning.example.com/"
+
+
+@pytest.fixture
+def plain_server(server, monkeypatch):
+    """ A server ignoring the Content-Encoding of the requests """
+    monkeypatch.setattr(fakeserver.FakeRequestHandler, "decode_request_content", lambda self, data: data)
+    return server
+
+
+def register(server, count):
+    macs = ["00041324%04X" % n for n in range(count)]
+    for mac in macs:
+        server.state.register(mac, server.user, "ACME", URL)
+    return macs
+
+
+def test_compressed_batches(server):
+    macs = register(server, 50)
+    snomcli.defaults["compress"] = 256
+    results = snomcli.multicall("redirect.getPhoneRedirection", [(mac,) for mac in macs], batch_size=25)
+    assert results == [[True, "ACME", URL]] * 50
+    assert snomcli.gzip_requests_supported and snomcli.multicall_supported
+    assert server.attempts == 2
+
+
+def test_server_ignoring_content_encoding(plain_server):
+    macs = register(plain_server, 50)
+    snomcli.defaults["compress"] = 256
+    results = snomcli.multicall("redirect.getPhoneRedirection", [(mac,) for mac in macs], batch_size=25)
+    assert results == [[True, "ACME", URL]] * 50
+    # the batches are sent again uncompressed, not as single calls
+    assert not snomcli.gzip_requests_supported and snomcli.multicall_supported
+    assert plain_server.attempts <= 4
+
+
+def test_async_server_ignoring_content_encoding(plain_server):
+    client = aioclient.AsyncRedirectionClient(plain_server.url, plain_server.user, plain_server.password,
+                                              compress=16)
+    loop = asyncio.new_event_loop()
+    try:
+        assert loop.run_until_complete(client.echo("x" * 100)) == "x" * 100
+        assert client.compress is None
+    finally:
+        client.close()
+        loop.run_until_complete(asyncio.sleep(0))
+        loop.close()
@@ -0,0 +1,18 @@
+# vi:si:et:sw=4:sts=4:ts=4
+# -*- coding: UTF-8 -*-
+"""The RPC endpoint of SNOM_URL"""
+
+import snomcli
+
+
+def test_split_rpc_url():
+    assert snomcli.split_rpc_url("https://secure-provisioning.snom.com:8083/xmlrpc/") == (
+        "secure-provisioning.snom.com:8083", "/xmlrpc/")
+    assert snomcli.split_rpc_url("https://host") == ("host", "/")
+    assert snomcli.split_rpc_url("https://host:8443?x=1") == ("host:8443", "/?x=1")
+
+
+def test_url_without_path(server, monkeypatch):
+    monkeypatch.setattr(snomcli, "rpc_url", server.url.rsplit("/", 2)[0])
+    assert snomcli.get_server().network.echo("hello") == "hello"
+    assert snomcli.get_server()("transport").endpoint[1] == "/"
@@ -0,0 +1,73 @@
+# vi:si:et:sw=4:sts=4:ts=4
+# -*- coding: UTF-8 -*-
+"""The journal of bulk jobs and 'resume'"""
+
+import snomcli
+
+URL = "http://provisioning.example.com/"
+
+
+def test_journal_outcomes(home):
+    journal = snomcli.Journal.create("import", ["phones.csv"])
+    journal.intent("000413240001", "add", URL)
+    journal.outcome("000413240001")
+    journal.intent("000413240002", "add", URL)
+    journal.outcome("000413240002", "Error:owned_by_other_user")
+    journal.intent("000413240003", "add", URL)
+    journal.outcome("000413240003", "ProtocolError", retry=True)
+    journal.intent("000413240004", "add", URL)
+    journal.close()
+
+    loaded = snomcli.find_job(journal.job)
+    assert loaded.command == "import" and loaded.args == ["phones.csv"] and not loaded.finished
+    assert loaded.completed() == set(["000413240001", "000413240002"])
+    assert loaded.unfinished() == set(["000413240003", "000413240004"])
+    assert loaded.in_doubt() == set(["000413240003", "000413240004"])
+    assert [mac for mac, operation, url in loaded.pending()] == ["000413240002", "000413240003", "000413240004"]
+
+
+def test_journal_survives_a_cut_line(home):
+    journal = snomcli.Journal.create("import", ["phones.csv"])
+    journal.intent("000413240001", "add", URL)
+    journal.outcome("000413240001")
+    journal.close()
+    with open(journal.path, "a") as logfile:
+        logfile.write('{"mac": "000413240002", "err')
+    assert snomcli.find_job(journal.job).completed() == set(["000413240001"])
+
+
+def test_resume_import(server, console, tmp_path):
+    phones = server.state.phones
+    csvfile = tmp_path / "phones.csv"
+    csvfile.write_text("".join("00041324000%d,%s\n" % (n, URL) for n in range(1, 5)))
+    journal = snomcli.Journal.create("import", [str(csvfile)])
+    # registered before the interruption
+    journal.intent("000413240001", "add", URL)
+    journal.outcome("000413240001")
+    # sent, and applied by the server, but interrupted before the answer was recorded
+    journal.intent("000413240002", "add", URL)
+    server.state.register("000413240002", server.user, "ACME", URL)
+    # no answer from the server
+    journal.intent("000413240003", "add", URL)
+    journal.outcome("000413240003", "ProtocolError", retry=True)
+    journal.close()
+
+    console.onecmd("resume %s" % journal.job)
+    # the completed row is not sent again
+    assert "000413240001" not in phones
+    for mac in ("000413240002", "000413240003", "000413240004"):
+        assert phones[mac][2] == URL
+    resumed = snomcli.find_job(journal.job)
+    assert resumed.finished
+    assert resumed.outcomes["000413240002"] is None
+    assert resumed.completed() == set("00041324000%d" % n for n in range(1, 5))
+
+
+def test_resume_finished_job(server, console, tmp_path, capsys):
+    csvfile = tmp_path / "phones.csv"
+    csvfile.write_text("000413240001,%s\n" % URL)
+    console.onecmd("import %s" % csvfile)
+    job = snomcli.load_jobs()[0].job
+    capsys.readouterr()
+    console.onecmd("resume %s" % job)
+    assert "already completed" in capsys.readouterr().out
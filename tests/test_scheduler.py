@@ -0,0 +1,118 @@
+# vi:si:et:sw=4:sts=4:ts=4
+# -*- coding: UTF-8 -*-
+"""Retries, backoff and adaptive concurrency of the request scheduler"""
+
+import socket
+
+import pytest
+
+import snomcli
+
+URL = "http://provisioning.example.com/"
+
+
+@pytest.fixture
+def fast_backoff(server, monkeypatch):
+    monkeypatch.setattr(snomcli.scheduler, "backoff_base", 0.001)
+    return snomcli.scheduler
+
+
+def test_is_transient():
+    refused = snomcli.ProtocolError("host", 503, "Service Unavailable", {})
+    gateway = snomcli.ProtocolError("host", 502, "Bad Gateway", {})
+    denied = snomcli.ProtocolError("host", 401, "Unauthorized", {})
+    dropped = socket.error("connection reset")
+    unsent = socket.error("connection refused")
+    unsent.before_request = True
+    assert snomcli.is_transient(refused, idempotent=False)
+    assert snomcli.is_transient(gateway) and not snomcli.is_transient(gateway, idempotent=False)
+    assert snomcli.is_transient(dropped) and not snomcli.is_transient(dropped, idempotent=False)
+    assert snomcli.is_transient(unsent, idempotent=False)
+    assert not snomcli.is_transient(denied)
+    assert not snomcli.is_transient(snomcli.Fault(1, "Error:no_such_mac"))
+
+
+def test_mutating_calls_are_not_resent(server, fast_backoff):
+    server.state.register("000413240002", server.user, "ACME", URL)
+    # a gateway error may hide a call the server applied
+    server.failures = [502, 502]
+    with pytest.raises(snomcli.ProtocolError):
+        snomcli.get_server().redirect.registerPhone("000413240001", URL)
+    with pytest.raises(snomcli.ProtocolError):
+        snomcli.get_server().redirect.deregisterPhone("000413240002")
+    assert server.attempts == 2
+    assert fast_backoff.retried == 0
+
+
+def test_refused_mutating_calls_are_resent(server, fast_backoff):
+    server.failures = [503, 429]
+    assert snomcli.get_server().redirect.registerPhone("000413240001", URL) == [True]
+    assert server.attempts == 3
+    assert server.state.phones["000413240001"][2] == URL
+
+
+def test_read_calls_are_retried(server, fast_backoff):
+    server.state.register("000413240001", server.user, "ACME", URL)
+    server.failures = [502, 503, 504]
+    assert snomcli.get_server().redirect.getPhoneRedirection("000413240001") == [True, "ACME", URL]
+    assert server.attempts == 4
+    assert fast_backoff.retried == 3
+
+
+def test_retries_give_up(server, fast_backoff):
+    snomcli.defaults["retries"] = 2
+    server.failures = [503] * 5
+    with pytest.raises(snomcli.ProtocolError):
+        snomcli.get_server().redirect.checkPhone("000413240001")
+    assert server.attempts == 3
+
+
+def test_random_errors(server, fast_backoff):
+    snomcli.defaults["retries"] = 10
+    server.error_rate = 0.3
+    results = snomcli.multicall("redirect.checkPhone", [("00041324%04X" % n,) for n in range(40)], batch_size=5)
+    assert results == [[False, "Error:no_such_mac"]] * 40
+
+
+def test_backoff():
+    scheduler = snomcli.Scheduler()
+    refused = snomcli.ProtocolError("host", 503, "Service Unavailable", {})
+    for attempt in range(snomcli.get_retries()):
+        for _ in range(20):
+            scheduler.enter()
+            delay = scheduler.fail(0.01, refused, attempt)
+            assert 0 <= delay <= min(scheduler.backoff_max, scheduler.backoff_base * 2 ** attempt)
+    scheduler.enter()
+    assert scheduler.fail(0.01, refused, snomcli.get_retries()) is None
+    scheduler.enter()
+    assert scheduler.fail(0.01, snomcli.Fault(1, "fault"), 0) is None
+
+
+def test_adaptive_concurrency(monkeypatch):
+    scheduler = snomcli.Scheduler()
+    monkeypatch.setattr(scheduler, "max_limit", lambda: 8.0)
+    scheduler.enter()
+    scheduler.leave(1.0)
+    assert scheduler.limit == 8.0
+    # multiplicative decrease on a failure...
+    scheduler.enter()
+    scheduler.leave(0.01, failed=True)
+    assert scheduler.limit == 4.0
+    # ...at most once per smoothed latency
+    scheduler.enter()
+    scheduler.leave(0.01, failed=True)
+    assert scheduler.limit == 4.0
+    # additive increase on successes, up to the limit of workers
+    for _ in range(4):
+        scheduler.enter()
+        scheduler.leave(0.01)
+    assert 4.0 < scheduler.limit < 5.0
+    for _ in range(100):
+        scheduler.enter()
+        scheduler.leave(0.01)
+    assert scheduler.limit == 8.0
+    # a latency spike counts as a failure
+    scheduler._decreased = 0.0
+    scheduler.enter()
+    scheduler.leave(scheduler.spike_factor * scheduler.latency * 2)
+    assert scheduler.limit == 4.0
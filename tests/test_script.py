@@ -0,0 +1,25 @@
+# vi:si:et:sw=4:sts=4:ts=4
+# -*- coding: UTF-8 -*-
+"""Batch mode: 'cli.py -f script'"""
+
+import io
+
+import snomcli
+
+
+def test_unknown_commands_fail(server, console, capsys):
+    status = snomcli.run_script(console, io.StringIO(u"version\nbogus\nhelp type\nhelp nothing\n"))
+    out = capsys.readouterr().out
+    assert status == 1
+    assert "--- 2: bogus (FAILED" in out
+    assert "--- 4: help nothing (FAILED" in out
+    # the help text is printed inside the block of its command
+    blocks = out.split("--- ")
+    assert "devie type" in [block for block in blocks if block.startswith("3: help type")][0]
+
+
+def test_one_command_fails(server, console):
+    console.onecmd("bogus")
+    assert snomcli.command_failed()
+    console.onecmd("version")
+    assert not snomcli.command_failed()
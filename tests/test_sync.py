@@ -0,0 +1,49 @@
+# vi:si:et:sw=4:sts=4:ts=4
+# -*- coding: UTF-8 -*-
+"""The removal plan of 'sync'"""
+
+import snomcli
+
+OLD = "http://old.example.com/"
+NEW = "http://new.example.com/"
+
+
+def test_sync_plan():
+    desired = {"000413240001": NEW, "000413240002": OLD, "000413240003": OLD}
+    current = {"000413240001": OLD, "000413240002": OLD, "000413240004": OLD, "000413240005": OLD}
+    assert snomcli.sync_plan(desired, current) == (
+        ["000413240003"], ["000413240001"], ["000413240004", "000413240005"], ["000413240002"])
+
+
+def test_sync_plan_keeps_skipped_macs():
+    current = {"000413240001": OLD, "000413240002": OLD}
+    add, change, remove, unchanged = snomcli.sync_plan({}, current, skipped=set(["000413240002"]))
+    assert remove == ["000413240001"]
+
+
+def test_sync_against_server(server, console, tmp_path):
+    phones = server.state.phones
+    for mac in ("000413240001", "000413240002", "000413240003", "000413240004"):
+        server.state.register(mac, server.user, "ACME", OLD)
+    server.state.register("000413240009", "someone else", "ACME", OLD)
+    desired = tmp_path / "desired.csv"
+    # 000413240002 has no url and there is no default url: an invalid row
+    desired.write_text("mac,url\n000413240001,%s\n000413240002\n000413240003,%s\n000413240005,%s\n"
+                       % (NEW, OLD, NEW))
+    console.onecmd("sync %s" % desired)
+    assert phones["000413240001"][2] == NEW
+    assert phones["000413240002"][2] == OLD
+    assert phones["000413240003"][2] == OLD
+    assert "000413240004" not in phones
+    assert phones["000413240005"] == [server.user, server.service.company, NEW]
+    assert phones["000413240009"][0] == "someone else"
+
+
+def test_sync_dry_run_changes_nothing(server, console, tmp_path, capsys):
+    server.state.register("000413240001", server.user, "ACME", OLD)
+    desired = tmp_path / "desired.csv"
+    desired.write_text("000413240002,%s\n" % NEW)
+    console.onecmd("sync %s --dry-run" % desired)
+    out = capsys.readouterr().out
+    assert "remove           1" in out
+    assert sorted(server.state.phones) == ["000413240001"]